@@ -0,0 +1,197 @@
+# bench_patch.py
+#
+# Benchmarks tycoon_patch.py on synthetic exe files, so no game files are needed.
+# Each fixture is random data with a PE header (carrying the bytes of the LAA fix)
+# and the search patterns of the game's rules put at random offsets.
+#
+# Usage: python benchmarks/bench_patch.py [--sizes=1,16,64,256] [--games=cruise,school]
+#        [--resolutions=1920x1080,3840x2160] [--in-place | --stream] [--output=results.json] [--compare=old.json]
+#
+# Results are saved as JSON, with --compare the times are printed next to the ones of an older run.
+
+import contextlib
+import io
+import multiprocessing
+import platform
+import random
+import struct
+import sys
+import os
+import json
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import tycoon_patch
+
+def make_pe_header(size):
+    # DOS stub pointing to a PE header without the LAA flag, and a section table
+    # with one .text section covering the rest of the file, so all the rules search all of it
+    header = bytearray(0x400)
+    header[0:2] = b"MZ"
+    struct.pack_into('<I', header, 0x3C, 0x80)
+    header[0x80:0x84] = b"PE\0\0"
+    struct.pack_into('<HHIIIHH', header, 0x84, 0x14C, 1, 0, 0, 0, 0xE0, 0x010F)
+    struct.pack_into('<H', header, 0x98, 0x10B)
+    struct.pack_into('<8sIIIIIIHHI', header, 0x98 + 0xE0, b".text", size - 0x400, 0x1000, size - 0x400,
+                     0x400, 0, 0, 0, 0, 0x60000020)
+    return header
+
+def make_fixture(fixture_path, calculated_crc, size, seed=0):
+    randomizer = random.Random(seed)
+    patterns = [bytes.fromhex(pattern) for pattern in tycoon_patch.get_rule_patterns(calculated_crc)]
+    header = make_pe_header(size)
+
+    with open(fixture_path, 'wb') as file:
+        file.write(header)
+        written = len(header)
+        block_size = 4 * 1024 * 1024
+        while written < size:
+            block = bytearray(os.urandom(min(block_size, size - written)))
+            # A few occurrences of each pattern in every block, like code using the same constant
+            for pattern in patterns:
+                if len(block) > len(pattern):
+                    for _ in range(2):
+                        offset = randomizer.randrange(0, len(block) - len(pattern))
+                        block[offset:offset + len(pattern)] = pattern
+            file.write(block)
+            written += len(block)
+
+def peak_rss_kb():
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Bytes on macOS, kilobytes elsewhere
+    return peak // 1024 if sys.platform == 'darwin' else peak
+
+def run_case(fixture_path, calculated_crc, width, height, in_place, stream=False):
+    # Runs in a fresh process, so the peak RSS is of this case alone
+    work_dir = tempfile.mkdtemp()
+    work_path = os.path.join(work_dir, "Game.exe")
+    tycoon_patch.clone_file(fixture_path, work_path)
+    os.environ["TYCOON_PATCH_CACHE"] = work_dir
+
+    result = {}
+    started = time.perf_counter()
+    tycoon_patch.calculate_crc(work_path)
+    result["crc"] = time.perf_counter() - started
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        rules = tycoon_patch.get_patch_rules(calculated_crc, width, height, laa_true=True)
+
+    if in_place or stream:
+        started = time.perf_counter()
+        counts = tycoon_patch.patch_file(work_path, rules, in_place, stream=stream)
+        result["rules_and_write"] = time.perf_counter() - started
+    else:
+        started = time.perf_counter()
+        content = tycoon_patch.read_content(work_path)
+        result["read"] = time.perf_counter() - started
+
+        started = time.perf_counter()
+        counts = tycoon_patch.patch_content(content, rules)
+        result["rules"] = time.perf_counter() - started
+
+        started = time.perf_counter()
+        tycoon_patch.write_file_atomic(work_path, content)
+        result["write"] = time.perf_counter() - started
+
+    result["matches"] = sum(counts)
+    result["peak_rss_kb"] = peak_rss_kb()
+
+    os.remove(work_path)
+    os.rmdir(work_dir)
+    return result
+
+def get_version():
+    # CRC of the patch script, to tell the runs of different versions apart
+    return f"{tycoon_patch.calculate_crc(tycoon_patch.__file__):08x}"
+
+def compare_results(old_results, new_results):
+    old_cases = {(case["game"], case["size_mb"], case["resolution"]): case for case in old_results["cases"]}
+    for case in new_results["cases"]:
+        old_case = old_cases.get((case["game"], case["size_mb"], case["resolution"]))
+        if not old_case:
+            continue
+        for phase in ("crc", "read", "rules", "write", "rules_and_write"):
+            if phase in case and old_case.get(phase):
+                ratio = case[phase] / old_case[phase]
+                print(f"{case['game']:>14} {case['size_mb']:>5} MB {case['resolution']:>9} {phase:>15}: "
+                      f"{old_case[phase]:.4f}s -> {case[phase]:.4f}s ({ratio:.2f}x)")
+
+def main(arguments):
+    sizes = [1, 16, 64, 256]
+    games = None
+    resolutions = [(1920, 1080), (3840, 2160)]
+    in_place = False
+    stream = False
+    output_path = None
+    compare_path = None
+    for arg in arguments[1:]:
+        if arg.startswith("--sizes="):
+            sizes = [int(size) for size in arg.split('=', 1)[1].split(',')]
+        elif arg.startswith("--games="):
+            games = arg.split('=', 1)[1].split(',')
+        elif arg.startswith("--resolutions="):
+            resolutions = [tuple(int(number) for number in res.split('x'))
+                           for res in arg.split('=', 1)[1].split(',')]
+        elif arg == "--in-place":
+            in_place = True
+        elif arg == "--stream":
+            stream = True
+        elif arg.startswith("--output="):
+            output_path = arg.split('=', 1)[1]
+        elif arg.startswith("--compare="):
+            compare_path = arg.split('=', 1)[1]
+
+    # One exe of each game, the latest version where there are several
+    game_crcs = {}
+    for calculated_crc, game_name in tycoon_patch.known_crcs.items():
+        if games is None or game_name in games:
+            game_crcs[game_name] = calculated_crc
+
+    results = {
+        "version": get_version(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "in_place": in_place,
+        "stream": stream,
+        "cases": []
+    }
+    fixture_dir = tempfile.mkdtemp()
+    context = multiprocessing.get_context("spawn")
+    try:
+        for game_name, calculated_crc in game_crcs.items():
+            for size_mb in sizes:
+                fixture_path = os.path.join(fixture_dir, f"{game_name}_{size_mb}.exe")
+                make_fixture(fixture_path, calculated_crc, size_mb * 1024 * 1024)
+                for width, height in resolutions:
+                    with context.Pool(1, maxtasksperchild=1) as pool:
+                        case = pool.apply(run_case, (fixture_path, calculated_crc, width, height, in_place, stream))
+                    case.update({"game": game_name, "size_mb": size_mb, "resolution": f"{width}x{height}"})
+                    results["cases"].append(case)
+                    phases = ", ".join(f"{phase} {case[phase]:.4f}s"
+                                       for phase in ("crc", "read", "rules", "write", "rules_and_write")
+                                       if phase in case)
+                    print(f"{game_name} {size_mb} MB {width}x{height}: {phases}, peak RSS {case['peak_rss_kb']} KB")
+                os.remove(fixture_path)
+    finally:
+        os.rmdir(fixture_dir)
+
+    if output_path is None:
+        output_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), "results",
+                                   f"{results['version']}_{time.strftime('%Y%m%d_%H%M%S')}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output_path)), exist_ok=True)
+    with open(output_path, 'w') as file:
+        json.dump(results, file, indent=2)
+    print(f"Results are saved to \"{output_path}\"")
+
+    if compare_path:
+        with open(compare_path) as file:
+            compare_results(json.load(file), results)
+
+if __name__ == "__main__":
+    main(sys.argv)
@@ -0,0 +1,292 @@
+# test_patch.py
+#
+# Regression tests of tycoon_patch.py that need no game files.
+#
+# Usage: python -m unittest discover tests
+
+import contextlib
+import io
+import random
+import struct
+import sys
+import os
+import tempfile
+import unittest
+import unittest.mock
+import zlib
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import tycoon_patch
+
+class ExeTestCase(unittest.TestCase):
+    # Each test gets its own cache and backup store, and a synthetic exe of Cruise Ship Tycoon:
+    # random bytes with the search patterns of its rules, registered under its own CRC
+    game_name = "cruise"
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.directory = directory.name
+        environ = unittest.mock.patch.dict(os.environ, {
+            "TYCOON_PATCH_CACHE": os.path.join(self.directory, "cache"),
+            "TYCOON_PATCH_STORE": os.path.join(self.directory, "store")
+        })
+        environ.start()
+        self.addCleanup(environ.stop)
+
+        self.content = self.make_content()
+        self.calculated_crc = zlib.crc32(self.content)
+        known_crcs = unittest.mock.patch.dict(tycoon_patch.known_crcs, {self.calculated_crc: self.game_name})
+        known_crcs.start()
+        self.addCleanup(known_crcs.stop)
+        self.game_path = os.path.join(self.directory, "game.exe")
+        with open(self.game_path, 'wb') as file:
+            file.write(self.content)
+
+    def make_content(self, size=64 * 1024):
+        content = bytearray(random.Random(0).randbytes(size))
+        with contextlib.redirect_stdout(io.StringIO()):
+            rules = tycoon_patch.get_game_rules(self.game_name, None, 1920, 1080)
+        for index, rule in enumerate(rules):
+            pattern = bytes.fromhex(rule.search)
+            offset = size // (len(rules) + 1) * (index + 1)
+            content[offset:offset + len(pattern)] = pattern
+        return bytes(content)
+
+    def read_exe(self):
+        with open(self.game_path, 'rb') as file:
+            return file.read()
+
+    def patch(self, resolution="1920x1080", **options):
+        with contextlib.redirect_stdout(io.StringIO()):
+            patch_plan = tycoon_patch.plan(self.game_path, resolution)
+        return tycoon_patch.apply(patch_plan, **options)
+
+class IdentifyTest(ExeTestCase):
+    def test_fingerprint_with_unknown_patch_sites(self):
+        # Every supported exe has a fingerprint, but the patch sites of this one are not known,
+        # as if its pack got a new rule, so the exe is identified by its CRC instead of being rejected
+        all_crcs = set(tycoon_patch.known_crcs) | set(tycoon_patch.copy_protected_crcs) | \
+            set(tycoon_patch.old_crcs)
+        fingerprints = {str(crc): {"size": 1, "regions": []} for crc in all_crcs}
+        fingerprints[str(self.calculated_crc)] = {"size": len(self.content), "regions": []}
+        tycoon_patch.save_tables(fingerprints, tycoon_patch.get_fingerprints_paths()[-1])
+
+        identity = tycoon_patch.identify_exe(self.game_path)
+        self.assertEqual(identity["crc"], self.calculated_crc)
+        self.assertEqual(identity["state"], "pristine")
+
+class InterruptedPatchTest(ExeTestCase):
+    def write_journal(self, edits):
+        entries = [[offset, original.hex(), data.hex()] for offset, original, data in edits]
+        tycoon_patch.write_journal(f"{self.game_path}.journal",
+                                   {"size": len(self.content), "edits": entries, "undo": None})
+
+    def test_rolled_forward(self):
+        # The first edit was written before the run stopped, the second one wasn't
+        self.write_journal([(100, self.content[100:102], b"\xaa\xbb"), (200, self.content[200:202], b"\xcc\xdd")])
+        with open(self.game_path, 'r+b') as file:
+            file.seek(100)
+            file.write(b"\xaa\xbb")
+        self.assertTrue(tycoon_patch.finish_interrupted_patch(self.game_path))
+        content = self.read_exe()
+        self.assertEqual((content[100:102], content[200:202]), (b"\xaa\xbb", b"\xcc\xdd"))
+        self.assertFalse(os.path.exists(f"{self.game_path}.journal"))
+
+    def test_stale_journal(self):
+        # A site that has neither the original nor the new bytes, and one past the end of the exe
+        for edits in ([(0, b"\x12\x34", b"\x00\x00")], [(len(self.content), b"\x00", b"\x01")]):
+            self.write_journal(edits)
+            with contextlib.redirect_stdout(io.StringIO()):
+                self.assertFalse(tycoon_patch.finish_interrupted_patch(self.game_path))
+            self.assertEqual(self.read_exe(), self.content)
+            self.assertFalse(os.path.exists(f"{self.game_path}.journal"))
+
+class RepatchTest(ExeTestCase):
+    def test_strict_keeps_patched_exe(self):
+        # A wrong number of matches stops the new patch before the exe is touched
+        self.patch("1920x1080")
+        patched = self.read_exe()
+        with contextlib.redirect_stdout(io.StringIO()):
+            rules = tycoon_patch.get_patch_rules(self.calculated_crc, 1280, 720)
+        wrong_counts = {key: 5 for key in tycoon_patch.get_count_keys(rules)}
+        tycoon_patch.save_patch_tables({str(self.calculated_crc): {"rule_counts": wrong_counts}})
+
+        with self.assertRaises(ValueError):
+            self.patch("1280x720", strict=True)
+        self.assertEqual(self.read_exe(), patched)
+        self.assertIsNotNone(tycoon_patch.read_undo_journal(self.game_path))
+
+class UndoJournalTest(ExeTestCase):
+    def test_repatch_and_restore(self):
+        for options in ({}, {"in_place": True}, {"stream": True}):
+            self.patch("1920x1080", **options)
+            result = self.patch("2560x1440", **options)
+            self.assertEqual(result["status"], "repatched")
+            self.assertEqual(tycoon_patch.read_undo_journal(self.game_path)["resolution"], "2560x1440")
+            with contextlib.redirect_stdout(io.StringIO()):
+                self.assertTrue(tycoon_patch.restore_backup(self.game_path))
+            self.assertEqual(self.read_exe(), self.content, options)
+            self.assertFalse(os.path.exists(tycoon_patch.get_undo_journal_path(self.game_path)))
+
+    def test_changed_exe(self):
+        # A patched site changed since the patch, the journal would write the wrong bytes back
+        self.patch("1920x1080")
+        offset, _, data = tycoon_patch.read_undo_journal(self.game_path)["edits"][-1]
+        with open(self.game_path, 'r+b') as file:
+            file.seek(offset)
+            file.write(bytes(byte ^ 0xFF for byte in bytes.fromhex(data)))
+        changed = self.read_exe()
+        self.assertIsNone(tycoon_patch.read_undo_journal(self.game_path))
+        self.assertIsNone(tycoon_patch.undo_patch(self.game_path))
+        self.assertEqual(self.read_exe(), changed)
+
+class StreamTest(ExeTestCase):
+    def test_patterns_over_block_borders(self):
+        # Blocks of 64 bytes, with matches starting before a border and ending after it, right at a border,
+        # and overlapping each other, so the scan and the write both have to handle the borders
+        content = bytearray(random.Random(0).randbytes(1024))
+        for offset in (62, 128, 189, 318, 320, 1020):
+            content[offset:offset + 4] = b"\xAA\xBB\xCC\xDD"
+        content[446:451] = b"\xAA\xAA\xAA\xAA\xAA"
+        content[703:705] = b"\xDD\xAA"
+        rules = [tycoon_patch.Rule("AABBCCDD", "11223344", ()), tycoon_patch.Rule("DDAA", "EEFF", ()),
+                 tycoon_patch.Rule("AAAA", "BBBB", ())]
+        with open(self.game_path, 'wb') as file:
+            file.write(content)
+
+        edits, counts = tycoon_patch.plan_edits(bytes(content), rules)
+        expected = bytearray(content)
+        tycoon_patch.apply_edits(expected, edits)
+        with unittest.mock.patch.object(tycoon_patch, "stream_block_size", 64):
+            self.assertEqual(tycoon_patch.patch_file(self.game_path, rules, stream=True), counts)
+        self.assertEqual(self.read_exe(), expected)
+        self.assertEqual(counts, [5, 1, 2])
+
+class PlanEditsTest(unittest.TestCase):
+    def test_same_as_chained_replace(self):
+        # Edits made from one scan give the same bytes as replacing the patterns one rule after another,
+        # small alphabets make the rules create and break each other's matches
+        randomizer = random.Random(0)
+        for _ in range(500):
+            content = bytes(randomizer.choice(b"\x00\x01\x02") for _ in range(randomizer.randrange(1, 200)))
+            rules = []
+            for _ in range(randomizer.randrange(1, 6)):
+                length = randomizer.randrange(1, 4)
+                search = bytes(randomizer.choice(b"\x00\x01\x02") for _ in range(length))
+                replace = bytes(randomizer.choice(b"\x00\x01\x02") for _ in range(length))
+                rules.append(tycoon_patch.Rule(search.hex(), replace.hex(), ()))
+
+            expected = content
+            for rule in rules:
+                expected = expected.replace(bytes.fromhex(rule.search), bytes.fromhex(rule.replace))
+            patched = bytearray(content)
+            edits, _ = tycoon_patch.plan_edits(patched, rules)
+            tycoon_patch.apply_edits(patched, edits)
+            self.assertEqual(bytes(patched), expected, rules)
+
+class SectionsTest(ExeTestCase):
+    def test_same_pattern_in_different_sections(self):
+        # Two rules with the same search pattern, each limited to its own section of a minimal PE
+        content = bytearray(random.Random(0).randbytes(0x3000))
+        content[:2] = b"MZ"
+        struct.pack_into('<I', content, 0x3C, 0x80)
+        content[0x80:0x84] = b"PE\0\0"
+        struct.pack_into('<H', content, 0x86, 2)
+        struct.pack_into('<H', content, 0x94, 0)
+        struct.pack_into('<8s8xII', content, 0x98, b".text", 0x1000, 0x1000)
+        struct.pack_into('<8s8xII', content, 0xC0, b".data", 0x1000, 0x2000)
+        content[0x1100:0x1104] = content[0x2100:0x2104] = b"\xAA\xBB\xCC\xDD"
+        rules = [tycoon_patch.Rule("AABBCCDD", "11111111", (".text",)),
+                 tycoon_patch.Rule("AABBCCDD", "22222222", (".data",))]
+
+        # Scanned the first time, taken from the patch table the second
+        for _ in range(2):
+            matches = tycoon_patch.find_rule_matches(content, rules, zlib.crc32(content))
+            edits, counts = tycoon_patch.plan_edits(content, rules, matches)
+            self.assertEqual(sorted(edits), [(0x1100, b"\x11" * 4), (0x2100, b"\x22" * 4)])
+            self.assertEqual(counts, [1, 1])
+
+class ReadResolutionTest(unittest.TestCase):
+    def test_patched_exe(self):
+        # The resolution is read back from the patch sites, for a resolution that was not tested as well
+        calculated_crc = 3759243516
+        randomizer = random.Random(0)
+        content = bytearray(randomizer.randbytes(64 * 1024))
+        patterns = [bytes.fromhex(pattern) for pattern in tycoon_patch.get_rule_patterns(calculated_crc)]
+        for index, pattern in enumerate(patterns):
+            offset = 1024 + 4096 * index
+            content[offset:offset + len(pattern)] = pattern
+        table = {pattern.hex(): offsets for pattern, offsets in tycoon_patch.find_matches(content, patterns).items()}
+
+        with contextlib.redirect_stdout(io.StringIO()):
+            rules = tycoon_patch.get_patch_rules(calculated_crc, 2560, 1080)
+        edits, _ = tycoon_patch.plan_edits(content, rules)
+        tycoon_patch.apply_edits(content, edits)
+        resolution = tycoon_patch.read_resolution(io.BytesIO(content), calculated_crc, table)
+        self.assertEqual(resolution, "2560x1080")
+
+class DeltaTest(unittest.TestCase):
+    def test_numbers(self):
+        # BPS numbers have no redundant encodings, so 128 takes two bytes as 0x00 0x80
+        self.assertEqual(bytes(tycoon_patch.encode_number(0)), b"\x80")
+        self.assertEqual(bytes(tycoon_patch.encode_number(128)), b"\x00\x80")
+        randomizer = random.Random(0)
+        numbers = [0, 1, 127, 128, 129, 16511, 16512, 2 ** 32] + [randomizer.randrange(2 ** 40) for _ in range(200)]
+        for number in numbers:
+            encoded = b"\xff" + tycoon_patch.encode_number(number) + b"\x00"
+            self.assertEqual(tycoon_patch.decode_number(encoded, 1), (number, len(encoded) - 1))
+
+    def test_round_trip(self):
+        # Edits at both ends of the file, next to each other and over each other
+        randomizer = random.Random(0)
+        source = randomizer.randbytes(4096)
+        edits = [(0, b"\x01\x02"), (100, b"\x03" * 8), (104, b"\x04" * 8), (108, b"\x05"), (4093, b"\x06" * 3)]
+        edits += [(offset, randomizer.randbytes(4)) for offset in randomizer.sample(range(200, 4000), 20)]
+        target = bytearray(source)
+        tycoon_patch.apply_edits(target, edits)
+
+        delta = tycoon_patch.make_delta(source, edits, '{"resolution": "1920x1080"}')
+        self.assertEqual(tycoon_patch.apply_delta(source, delta), target)
+        self.assertEqual(tycoon_patch.read_delta_metadata(delta), '{"resolution": "1920x1080"}')
+
+    def test_other_source(self):
+        source = random.Random(0).randbytes(4096)
+        delta = tycoon_patch.make_delta(source, [(10, b"\x00\x01")])
+        changed = bytearray(source)
+        changed[2000] ^= 0xFF
+        for other_source in (changed, source[:-1]):
+            with self.assertRaises(ValueError):
+                tycoon_patch.apply_delta(other_source, delta)
+        damaged = bytearray(delta)
+        damaged[-20] ^= 0xFF
+        with self.assertRaises(ValueError):
+            tycoon_patch.apply_delta(source, damaged)
+
+class CrcTest(unittest.TestCase):
+    def test_combine_crcs(self):
+        randomizer = random.Random(0)
+        for _ in range(200):
+            first = randomizer.randbytes(randomizer.randrange(0, 300))
+            second = randomizer.randbytes(randomizer.randrange(0, 300))
+            self.assertEqual(tycoon_patch.combine_crcs(zlib.crc32(first), zlib.crc32(second), len(second)),
+                             zlib.crc32(first + second))
+
+    def test_parallel_crc(self):
+        # Ranges of a few bytes, so the file is hashed in many pieces, the last one shorter
+        data = random.Random(0).randbytes(10007)
+        range_size = tycoon_patch.crc_range_size
+        with tempfile.TemporaryDirectory() as directory:
+            file_path = os.path.join(directory, "game.exe")
+            with open(file_path, 'wb') as file:
+                file.write(data)
+            try:
+                tycoon_patch.crc_range_size = 1000
+                self.assertEqual(tycoon_patch.calculate_crc(file_path, workers=4), zlib.crc32(data))
+                self.assertEqual(tycoon_patch.calculate_crc(file_path, workers=1), zlib.crc32(data))
+            finally:
+                tycoon_patch.crc_range_size = range_size
+
+if __name__ == "__main__":
+    unittest.main()
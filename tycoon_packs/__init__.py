@@ -0,0 +1,95 @@
+# tycoon_packs
+#
+# Rule packs of the supported games. Each pack is a module with two functions:
+#
+#   get_rules(game_name, calculated_crc, width, height) returns the rules of the resolution,
+#       in the order they have to be applied, as (search, replace) or (search, replace, sections)
+#   get_disk_check_rules(game_name) returns the (search, replace) rules removing the disk check
+#
+# The index below tells the patch which pack has the rules of a game, so only that one is imported.
+# Packs of other games can be added without changing the patch: a module with its own "games" index
+# of the same kind is listed in TYCOON_PATCH_PACKS (comma separated), along with the modules of its packs.
+#
+# "title" is shown by --games, games without one are not listed there.
+# "copy_protected_crcs" maps the CRC of each exe with disk check to the CRC it has once the disk check
+# is removed, which has to be one of "crcs", as its rules are used for the rest of the patch
+
+games = {
+    "cruise": {
+        "pack": "tycoon_packs.cruise",
+        "title": "Cruise Ship Tycoon (2003)",
+        "exes": ["CruiseShipTycoon.exe"],
+        "crcs": [
+            1142252342, # old version
+            3759243516  # latest version
+        ],
+        "copy_protected_crcs": {},
+        "old_crcs": []
+    },
+    "medieval": {
+        "pack": "tycoon_packs.extreme",
+        "title": "Medieval Conquest (2004)",
+        "exes": ["MC.exe"],
+        "crcs": [2552423476],
+        "copy_protected_crcs": {},
+        "old_crcs": [1756356010]
+    },
+    "challenge": {
+        "pack": "tycoon_packs.challenge",
+        "title": "Outdoor Life: Sportsman's Challenge (2004)",
+        "exes": ["SC.exe"],
+        "crcs": [554985168],
+        "copy_protected_crcs": {695746026: 554985168},
+        "old_crcs": []
+    },
+    "school": {
+        "pack": "tycoon_packs.school",
+        "title": "School Tycoon (2004)",
+        "exes": ["SchoolTycoon.exe"],
+        "crcs": [490347772],
+        "copy_protected_crcs": {},
+        "old_crcs": [4056039368]
+    },
+    "extreme": {
+        "pack": "tycoon_packs.extreme",
+        "title": "Ski Resort Extreme (2004)",
+        "exes": ["SRE.exe"],
+        "crcs": [3371513462],
+        "copy_protected_crcs": {3801619499: 3371513462},
+        "old_crcs": [2176966923]
+    },
+    "mall3": {
+        "pack": "tycoon_packs.mall3",
+        "title": "Mall Tycoon 3 (2005)",
+        "exes": ["Mall3Game.exe"],
+        "crcs": [495043694],
+        "copy_protected_crcs": {1814945630: 495043694},
+        "old_crcs": []
+    },
+    "wildfire": {
+        "pack": "tycoon_packs.extreme",
+        "title": "Wildfire (2005)",
+        "exes": ["Wildfire.exe"],
+        "crcs": [667719983],
+        "copy_protected_crcs": {1646831127: 667719983},
+        "old_crcs": []
+    },
+    "ski": {
+        "pack": "tycoon_packs.ski",
+        # Resolution is not patched yet, only the disk check is removed
+        "title": None,
+        "exes": ["SkiGame.exe"],
+        "crcs": [1447773004],
+        "copy_protected_crcs": {3047680879: 1447773004},
+        "old_crcs": [3298446386]
+    },
+    "skateboard2004": {
+        "pack": "tycoon_packs.challenge",
+        # HUD is not fixed yet
+        "title": None,
+        "exes": ["Skate3.exe"],
+        "crcs": [2787501884],
+        "copy_protected_crcs": {},
+        "old_crcs": []
+    }
+}
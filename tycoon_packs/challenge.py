@@ -0,0 +1,34 @@
+# tycoon_packs/challenge.py
+#
+# Outdoor Life: Sportsman's Challenge and Skateboard Park Tycoon 2004, made on the same engine
+
+import struct
+
+def get_rules(game_name, calculated_crc, width, height):
+    rules = []
+
+    width_le = struct.pack('<I', width).hex()
+    height_le = struct.pack('<I', height).hex()
+
+    rules.append(("c7402c00050000", f"c7402c{width_le}"))
+    rules.append(("c74030c0030000", f"c74030{height_le}"))
+
+    # HUD fixes
+    rules.append(("740b3d00050000", f"740b3d{width_le}"))
+    if game_name == "skateboard2004":
+        # Remove black bars
+        # Move buttons below to the left
+        # Fix cursor
+        pass
+    else:
+        rules.append(("741a3d00050000", f"741a3d{width_le}"))
+
+        # This moves the options window in-game to the upper left corner, so that it no longer mutes the game
+        rules.append(("2BC2D1F889442410E8", "2BC231C089442410E8"))
+        rules.append(("8BC5992BC28BE8D1FD", "8BC5992BC28BE831ED"))
+    return rules
+
+def get_disk_check_rules(game_name):
+    if game_name == "challenge":
+        return [("E8D8FDFFFF85C07547", "E8D8FDFFFF85C0EB47")]
+    return []
@@ -0,0 +1,75 @@
+# tycoon_packs/cruise.py
+#
+# Cruise Ship Tycoon
+
+import struct
+
+def get_rules(game_name, calculated_crc, width, height):
+    rules = []
+
+    width_le = struct.pack('<I', width).hex()
+    height_le = struct.pack('<I', height).hex()
+
+    # Notice if game version is not the latest
+    if calculated_crc == 1142252342:
+        print(" FYI: this is not the latest version of the game")
+        print(" Not that it matters, this patch will work as is.")
+        print(" But if you wish, look for Update 3 of the game,")
+        print(" and patch again after updating.")
+
+    # Main Menu resolution
+    menu_height = height
+    menu_width = (4 * menu_height) / 3
+    menu_width = round(menu_width)
+
+    if (menu_width == 1067 and menu_height == 800) or \
+            (menu_width == 1200 and menu_height == 900):
+        # These 4:3 resolutions make the game render in 640x480,
+        # using 1024x768
+        menu_width = 1024
+        menu_height = 768
+    elif (menu_width == 960 and menu_height == 720):
+        # Same as above
+        # using 1920x1440
+        menu_width = 800
+        menu_height = 600
+    elif (menu_width == 2880 and menu_height == 2160):
+        # Same as above
+        # using 1920x1440
+        menu_width = 1920
+        menu_height = 1440
+
+    menu_width_le = struct.pack('<I', menu_width).hex()
+    menu_height_le = struct.pack('<I', menu_height).hex()
+
+    print(f"Changing menu resolution to {menu_width}x{menu_height}")
+    if calculated_crc == 1142252342:
+        rules.append(("20030000C744243858020000",
+                      f"{menu_width_le}C7442438{menu_height_le}"))
+    elif calculated_crc == 3759243516:
+        rules.append(("20030000C744243458020000",
+                      f"{menu_width_le}C7442434{menu_height_le}"))
+
+    # In-game resolution
+    if calculated_crc == 1142252342:
+        rules.append(("00050000E8DCF80100C74030C0030000",
+                      f"{width_le}E8DCF80100C74030{height_le}"))
+    elif calculated_crc == 3759243516:
+        rules.append(("00050000E80AE50100C74030C0030000",
+                      f"{width_le}E80AE50100C74030{height_le}"))
+
+    # HUD fixes
+    rules.append(("3d000500007505",
+                  f"3d{width_le}7505"))
+
+    fix_height = height - 600
+
+    # Convert fix value to little-endian hexadecimal value
+    fix_h_le = struct.pack('<I', fix_height).hex()
+
+    rules.append(("BD68010000C7", f"BD{fix_h_le}C7"))
+    rules.append(("000500007509BD68010000", f"{width_le}7509BD{fix_h_le}"))
+    return rules
+
+def get_disk_check_rules(game_name):
+    return []
@@ -0,0 +1,31 @@
+# tycoon_packs/extreme.py
+#
+# Ski Resort Extreme, Wildfire and Medieval Conquest, made on the same engine
+
+import struct
+
+def get_rules(game_name, calculated_crc, width, height):
+    rules = []
+
+    width_le = struct.pack('<I', width).hex()
+    height_le = struct.pack('<I', height).hex()
+
+    # In-game resolution
+    rules.append(("c7402c00050000",
+                  f"c7402c{width_le}"))
+    rules.append(("c74030c0030000",
+                  f"c74030{height_le}"))
+
+    # HUD fixes
+    rules.append(("740B3D00050000",
+                  f"740B3D{width_le}"))
+    return rules
+
+def get_disk_check_rules(game_name):
+    rules = []
+    if game_name == "extreme":
+        rules.append(("752D84C08BCF7427A014E06900908D64240084C074198A1980CB200C203AD8750E8A440E014184C0746E",
+                      "909084C08BCF9090A014E06900908D64240084C090908A1980CB200C203AD890908A440E014184C0EB6E"))
+    elif game_name == "wildfire":
+        rules.append(("0F8518FFFFFFE8", "E919FFFFFFFFE8"))
+    return rules
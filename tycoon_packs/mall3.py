@@ -0,0 +1,23 @@
+# tycoon_packs/mall3.py
+#
+# Mall Tycoon 3
+
+import struct
+
+def get_rules(game_name, calculated_crc, width, height):
+    rules = []
+
+    width_le = struct.pack('<I', width).hex()
+    height_le = struct.pack('<I', height).hex()
+
+    # Resolution
+    rules.append(("c7402800050000", f"c74028{width_le}"))
+    rules.append(("c7402cc0030000", f"c7402c{height_le}"))
+
+    # HUD fixes
+    rules.append(("740e3d00050000", f"740e3d{width_le}"))
+    rules.append(("0f84e70000003d00050000", f"0f84e70000003d{width_le}"))
+    return rules
+
+def get_disk_check_rules(game_name):
+    return [("8B35B0F26B00EB09", "8B35B0F26B00EB2B")]
@@ -0,0 +1,114 @@
+# tycoon_packs/school.py
+#
+# School Tycoon
+
+import struct
+
+def get_rules(game_name, calculated_crc, width, height):
+    rules = []
+
+    width_le = struct.pack('<I', width).hex()
+    height_le = struct.pack('<I', height).hex()
+
+    # In-game resolution
+    rules.append(("402C00050000",
+                  f"402C{width_le}"))
+    rules.append(("4030C0030000",
+                  f"4030{height_le}"))
+
+    # HUD fixes
+    if width != 1280:
+        # Fixing position of the buttons in the lower side of the screen
+        # by replacing E0FCFFFF (-800) with negative value of the current width
+        negative_width = -width
+        negative_width_le = struct.pack('<i', negative_width).hex()
+        rules.append(("8D81E0FCFFFF",
+                      f"8D81{negative_width_le}"))
+
+        # Prevents game crashes
+        rules.append(("741A3D00050000",
+                      f"741A3D{width_le}"))
+        rules.append(("eb093d00050000",
+                      f"eb093d{width_le}"))
+        rules.append(("740B3D00050000",
+                      f"740B3D{width_le}"))
+        rules.append(("e8896502003d00050000",
+                      f"e8896502003d{width_le}"))
+        rules.append(("74243d00050000",
+                      f"74243d{width_le}"))
+        rules.append(("e8dece00003d00050000",
+                      f"e8dece00003d{width_le}"))
+        rules.append(("e893cb00003d00050000",
+                      f"e893cb00003d{width_le}"))
+        rules.append(("e851c900003d00050000",
+                      f"e851c900003d{width_le}"))
+
+    # Fixing position of objectives button and history button
+    # The position is relative to the respective window that's opened after button is pressed,
+    # so we calculate needed value based on that
+    if width == 1280:
+        # Buttons are centered, so their position is a bit different
+        objective_x = 712 - ((width / 2) - 148)
+        history_x = 770 - ((width / 2) - 175)
+    else:
+        objective_x = 472 - ((width / 2) - 148)
+        history_x = 530 - ((width / 2) - 175)
+
+    history_y = (height - 33) - ((height / 2) - 212)
+    objective_y = (height - 33) - ((height / 2) - 113)
+    objective_y_instant = objective_y - 25
+
+    if objective_x < 0:
+        o_x_le = struct.pack('<i', int(objective_x)).hex()
+    else:
+        o_x_le = struct.pack('<I', int(objective_x)).hex()
+    o_y_le = struct.pack('<I', int(objective_y)).hex()
+    o_y_i_le = struct.pack('<I', int(objective_y_instant)).hex()
+
+    if history_x < 0:
+        h_x_le = struct.pack('<i', int(history_x)).hex()
+    else:
+        h_x_le = struct.pack('<I', int(history_x)).hex()
+    h_y_le = struct.pack('<I', int(history_y)).hex()
+
+    rules.append(("740B81C730020000",
+                  f"740B81C7{o_y_le}"))
+    rules.append(("81c717020000",
+                  f"81c7{o_y_i_le}"))
+    rules.append(("526A4F81C6DC000000",
+                  f"526A4F81C6{o_x_le}"))
+
+    rules.append(("68930200006831010000",
+                  f"68{h_y_le}68{h_x_le}"))
+
+    # Save game window
+    if width == 1280 and height == 720:
+        rules.append(("81FB00040000",
+                      f"81FB{width_le}"))
+        rules.append(("81FB00050000",
+                      f"81FB00000000"))
+
+        save_x = (width / 2)
+        save_y = (height / 2)
+    else:
+        rules.append(("81FB00050000",
+                      f"81FB{width_le}"))
+
+        save_x = (width / 2) - 240
+        save_y = (height / 2) - 180
+
+    save_x_le = struct.pack('<I', int(save_x)).hex()
+    save_y_le = struct.pack('<I', int(save_y)).hex()
+
+    rules.append(("2D90010000",
+                  f"2D{save_x_le}"))
+    rules.append(("2D2C010000",
+                  f"2D{save_y_le}"))
+
+    # Removes displaced frame in a classroom view
+    # The string is with the other constants, not in the code
+    rules.append(("313238307839363000", f"000000000000000000", (".rdata", ".data")))
+    return rules
+
+def get_disk_check_rules(game_name):
+    return []
@@ -0,0 +1,11 @@
+# tycoon_packs/ski.py
+#
+# Ski Resort Tycoon
+
+def get_rules(game_name, calculated_crc, width, height):
+    # This game requires Windows XP compatibility mode on Windows, otherwise it glitches
+    # Have no idea how to that one yet
+    return []
+
+def get_disk_check_rules(game_name):
+    return [("74206A15", "EB206A15")]
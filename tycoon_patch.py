@@ -27,29 +27,252 @@
 # OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
 # SOFTWARE.
 
+import collections
+import concurrent.futures
+import contextlib
+import functools
+import importlib
+import io
+import json
+import mmap
 import shutil
 import struct
 import zlib
 import sys
 import os
 import re
+import time
+
+import tycoon_packs
+
+def load_game_index():
+    # Supported games: the packs shipped with the patch and the ones listed in TYCOON_PATCH_PACKS.
+    # Only the index of each is loaded here, the rules of a game are imported when they are needed
+    games = dict(tycoon_packs.games)
+    for index_name in os.environ.get("TYCOON_PATCH_PACKS", "").split(','):
+        if index_name.strip():
+            games.update(importlib.import_module(index_name.strip()).games)
+    return games
+
+game_index = load_game_index()
+
+known_exes = [exe for game in game_index.values() for exe in game["exes"]]
+known_crcs = {crc: game_name for game_name, game in game_index.items() for crc in game["crcs"]}
+copy_protected_crcs = {crc: game_name for game_name, game in game_index.items()
+                       for crc in game["copy_protected_crcs"]}
+old_crcs = {crc: game_name for game_name, game in game_index.items() for crc in game["old_crcs"]}
+cracked_crcs = {crc: cracked_crc for game in game_index.values()
+                for crc, cracked_crc in game["copy_protected_crcs"].items()}
+
+tested_resolutions = {
+    "1280x720": (1280, 720),
+    "1280x800": (1280, 800),
+    "1360x768": (1360, 768),
+    "1366x768": (1366, 768),
+    "1600x900": (1600, 900),
+    "1920x1080": (1920, 1080),
+    "2560x1440": (2560, 1440),
+    "3840x2160": (3840, 2160)
+}
+
+# File sizes of the exes above, by CRC
+# Sizes also come from the fingerprints (the ones shipped with the patch, made by --build-tables,
+# and the ones made for the exes identified so far) and from the identification cache
+known_sizes = {}
+
+# Fingerprints are made of this many regions of this size, spread over the exe
+fingerprint_regions = 8
+fingerprint_region_size = 1024
+
+# Files of at least two ranges of this size get their CRC calculated on several threads
+crc_range_size = 32 * 1024 * 1024
+crc_polynomial = 0xEDB88320
+
+# With --stream the exe is read and written in blocks of this size, whatever the size of the exe
+stream_block_size = 1024 * 1024
+
+# A rule of the patch: bytes to search for, bytes to replace them with, sections of the exe
+# that are searched, and how many matches it should have. When the exe has none of the sections,
+# the whole file is searched. Without a count, the one from the patch table of the exe is expected,
+# or at least one match if the table has none
+Rule = collections.namedtuple("Rule", ["search", "replace", "sections", "count"], defaults=[(".text",), None])
+
+# LAA fix (4GB patch) sets IMAGE_FILE_LARGE_ADDRESS_AWARE in the COFF characteristics of the exe.
+# The bytes of its rule are the usual characteristics followed by the optional header magic,
+# they are only searched for when the PE header can't be read
+laa_flag = 0x20
+laa_rule = Rule("0F010B01", "2F010B01", ("header",), 1)
+
+# Timings of the patching phases, collected with --timings or --json
+phase_log = None
 
 # Functions
-def calculate_crc(file_path):
-    crc = 0
-    with open(file_path, 'rb') as file:
-        while True:
-            chunk = file.read(1024)
-            if not chunk:
-                break
-            crc = zlib.crc32(chunk, crc)
-    crc = crc & 0xFFFFFFFF
+@contextlib.contextmanager
+def timed_phase(phase, **details):
+    # Records how long the phase took, the caller can add the number of bytes it touched and so on
+    if phase_log is None:
+        yield details
+        return
+    started = time.perf_counter()
+    try:
+        yield details
+    finally:
+        phase_log.append({"phase": phase, **details, "seconds": round(time.perf_counter() - started, 6)})
+
+def calculate_crc(file_path, workers=None):
+    # Large reads into the same buffer, the file is never loaded as a whole.
+    # A large file is split into ranges hashed on a pool of threads (zlib lets go of the GIL
+    # while hashing), then their CRCs are combined into the CRC of the whole file
+    size = os.path.getsize(file_path)
+    with timed_phase("crc", bytes=size):
+        if size < 2 * crc_range_size or workers == 1:
+            return calculate_range_crc(file_path, 0, size)
+
+        ranges = [(start, min(start + crc_range_size, size)) for start in range(0, size, crc_range_size)]
+        with concurrent.futures.ThreadPoolExecutor(max_workers=workers or os.cpu_count()) as executor:
+            range_crcs = executor.map(lambda range_: calculate_range_crc(file_path, *range_), ranges)
+            crc = 0
+            for (start, end), range_crc in zip(ranges, range_crcs):
+                crc = combine_crcs(crc, range_crc, end - start)
     return crc
 
-def replace_bytes(content, search, replace):
-    search_bytes = bytes.fromhex(search)
-    replace_bytes = bytes.fromhex(replace)
-    return content.replace(search_bytes, replace_bytes)
+def calculate_range_crc(file_path, start, end):
+    crc = 0
+    buffer = bytearray(1024 * 1024)
+    view = memoryview(buffer)
+    with open(file_path, 'rb', buffering=0) as file:
+        file.seek(start)
+        remaining = end - start
+        while remaining:
+            size = file.readinto(view[:min(len(buffer), remaining)])
+            if not size:
+                break
+            crc = zlib.crc32(view[:size], crc)
+            remaining -= size
+    return crc & 0xFFFFFFFF
+
+# CRC-32 combination as in zlib's crc32_combine(), which the zlib module doesn't have.
+# Polynomials are in the reflected bit order of CRC-32, the highest bit being x^0
+def multiply_crc_polynomials(a, b):
+    # a * b modulo the CRC-32 polynomial
+    product = 0
+    bit = 1 << 31
+    while a:
+        if a & bit:
+            product ^= b
+            a ^= bit
+        bit >>= 1
+        b = (b >> 1) ^ crc_polynomial if b & 1 else b >> 1
+    return product
+
+def combine_crcs(first_crc, second_crc, second_length):
+    # CRC of two pieces of data from the CRCs of each, by shifting the first one over
+    # the length of the second: multiplying it by x^(8 * length), worked out by squaring x
+    shift = 1 << 31
+    square = 1 << 30
+    exponent = 8 * second_length
+    while exponent:
+        if exponent & 1:
+            shift = multiply_crc_polynomials(square, shift)
+        square = multiply_crc_polynomials(square, square)
+        exponent >>= 1
+    return multiply_crc_polynomials(shift, first_crc) ^ second_crc
+
+def check_crc(calculated_crc, content=None, file_path=None):
+    # Exes identified by their fingerprint have their CRC calculated before anything is written
+    # or backed up for them, as the fingerprint only samples a part of the exe
+    actual_crc = zlib.crc32(content) if file_path is None else calculate_crc(file_path)
+    if actual_crc != calculated_crc:
+        raise ValueError(f"The exe looks like the one with CRC {calculated_crc}, but its CRC is {actual_crc}. "
+                         f"It was probably modified, nothing was written.")
+
+def get_game_name(calculated_crc):
+    for crcs in (known_crcs, copy_protected_crcs, old_crcs):
+        if calculated_crc in crcs:
+            return crcs[calculated_crc]
+    return None
+
+def get_cache_dir():
+    if os.environ.get("TYCOON_PATCH_CACHE"):
+        return os.environ["TYCOON_PATCH_CACHE"]
+    if os.name == 'nt' and os.environ.get("LOCALAPPDATA"):
+        return os.path.join(os.environ["LOCALAPPDATA"], "tycoon_patch")
+    cache_home = os.environ.get("XDG_CACHE_HOME") or os.path.join(os.path.expanduser("~"), ".cache")
+    return os.path.join(cache_home, "tycoon_patch")
+
+def load_id_cache():
+    # Identification cache: CRC of every exe seen before, keyed by path,
+    # plus sizes of the known exes learned along the way
+    cache = {"files": {}, "sizes": {}}
+    try:
+        with open(os.path.join(get_cache_dir(), "identify.json")) as file:
+            cache.update(json.load(file))
+    except (OSError, ValueError):
+        pass
+    return cache
+
+def save_id_cache(cache):
+    # The cache is only there to save time, not being able to write it is fine
+    try:
+        os.makedirs(get_cache_dir(), exist_ok=True)
+        cache_path = os.path.join(get_cache_dir(), "identify.json")
+        temp_path = f"{cache_path}.{os.getpid()}.tmp"
+        with open(temp_path, 'w') as file:
+            json.dump(cache, file)
+        os.replace(temp_path, cache_path)
+    except OSError:
+        pass
+
+def get_file_stamp(file_path):
+    # A file with the same size, modification time and inode is taken as unchanged
+    stat = os.stat(file_path)
+    return [stat.st_size, stat.st_mtime_ns, stat.st_ino]
+
+def remember_crc(cache, file_path, stamp, calculated_crc):
+    cache["files"][os.path.abspath(file_path)] = {
+        "stamp": stamp,
+        "crc": calculated_crc,
+        "game": get_game_name(calculated_crc)
+    }
+    if get_game_name(calculated_crc):
+        cache["sizes"][str(calculated_crc)] = stamp[0]
+
+def cached_crc(cache, file_path, stamp):
+    entry = cache["files"].get(os.path.abspath(file_path))
+    if entry and entry["stamp"] == stamp:
+        return entry["crc"]
+    return None
+
+@functools.lru_cache(maxsize=None)
+def get_fingerprint_sizes():
+    # Loaded once, sizes of the exes fingerprinted later only show up in the next run
+    return {int(crc): fingerprint["size"] for crc, fingerprint in load_tables(get_fingerprints_paths()).items()
+            if "size" in fingerprint}
+
+def size_rules_out(cache, size):
+    # Once the size of every supported exe is known,
+    # files of any other size can be rejected without reading them
+    sizes = dict(known_sizes)
+    sizes.update(get_fingerprint_sizes())
+    sizes.update((int(crc), crc_size) for crc, crc_size in cache["sizes"].items())
+    all_crcs = set(known_crcs) | set(copy_protected_crcs) | set(old_crcs)
+    return all_crcs.issubset(sizes) and size not in sizes.values()
+
+def identify_crc(file_path, cache=None):
+    # Returns CRC of the file, using the cache when the file is unchanged,
+    # or None if the size alone shows it's not a supported exe
+    if cache is None:
+        return calculate_crc(file_path)
+
+    stamp = get_file_stamp(file_path)
+    with timed_phase("crc_cache", bytes=0):
+        calculated_crc = cached_crc(cache, file_path, stamp)
+    if calculated_crc is None:
+        if size_rules_out(cache, stamp[0]):
+            return None
+        calculated_crc = calculate_crc(file_path)
+        remember_crc(cache, file_path, stamp, calculated_crc)
+    return calculated_crc
 
 def replace_bytes_range(content, start_offset_hex, end_offset_hex, replacement_bytes_hex):
     # Convert hexadecimal offsets to integers
@@ -78,40 +301,837 @@ def replace_bytes_range(content, start_offset_hex, end_offset_hex, replacement_b
 
     return replaced_content
 
-def get_res(res=False):
-    tested_resolutions = {
-        "1280x720": (1280, 720),
-        "1280x800": (1280, 800),
-        "1360x768": (1360, 768),
-        "1366x768": (1366, 768),
-        "1600x900": (1600, 900),
-        "1920x1080": (1920, 1080),
-        "2560x1440": (2560, 1440),
-        "3840x2160": (3840, 2160)
-    }
+def read_content(file_path):
+    # Reads the whole file straight into a mutable buffer,
+    # so the patches can be written into it without making new copies
+    content = bytearray(os.path.getsize(file_path))
+    with timed_phase("read", bytes=len(content)):
+        with open(file_path, 'rb') as file:
+            file.readinto(content)
+    return content
+
+@contextlib.contextmanager
+def map_content(file_path):
+    # Read-only memory map of the file, only the pages that are looked at are read
+    with open(file_path, 'rb') as file:
+        with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as content:
+            yield content
+
+class FileContent:
+    # Read-only view of an opened file that reads only the slices asked for,
+    # so the edits of a file can be planned without loading it
+    def __init__(self, file):
+        self.file = file
+        self.size = os.fstat(file.fileno()).st_size
+
+    def __len__(self):
+        return self.size
+
+    def __getitem__(self, key):
+        if not isinstance(key, slice):
+            return self[key:key + 1][0]
+        start, stop, _ = key.indices(self.size)
+        self.file.seek(start)
+        return self.file.read(max(stop - start, 0))
+
+class OriginalContent(FileContent):
+    # FileContent of a patched exe with the original bytes of its patched sites put back,
+    # as get_original_bytes() worked them out from the undo journal
+    def __init__(self, file, sites):
+        super().__init__(file)
+        self.sites = sites
+
+    def __getitem__(self, key):
+        if not isinstance(key, slice):
+            return self[key:key + 1][0]
+        start, stop, _ = key.indices(self.size)
+        data = bytearray(super().__getitem__(key))
+        for offset, value in self.sites.items():
+            if start <= offset < stop:
+                data[offset - start] = value
+        return bytes(data)
+
+@functools.lru_cache(maxsize=None)
+def compile_patterns(patterns):
+    # One regex for all the search patterns of a game, so the file is scanned once
+    # no matter how many rules there are.
+    # Patterns are grouped by their first byte to tell which of them matched
+    regex = re.compile(b"|".join(re.escape(pattern) for pattern in patterns))
+    by_first_byte = {}
+    for pattern in patterns:
+        by_first_byte.setdefault(pattern[0], []).append(pattern)
+    return regex, by_first_byte
+
+def find_matches(content, patterns, ranges=None):
+    # Returns offsets of all occurrences of each pattern within the ranges (the whole content by default),
+    # overlapping ones included
+    regex, by_first_byte = compile_patterns(tuple(sorted(set(patterns))))
+    matches = {pattern: [] for pattern in patterns}
+
+    for start, end in ranges or [(0, len(content))]:
+        match = regex.search(content, start, end)
+        while match:
+            offset = match.start()
+            for pattern in by_first_byte[content[offset]]:
+                if content[offset:offset + len(pattern)] == pattern and offset + len(pattern) <= end:
+                    matches[pattern].append(offset)
+            # Searching again from the next byte, as another pattern may start inside this match
+            match = regex.search(content, offset + 1, end)
+
+    return matches
+
+def find_matches_in_blocks(content, patterns, ranges):
+    # Same as find_matches() for a file read in blocks. Each block is read along with the start
+    # of the next one, so a pattern running over the border is found, in the block it starts in
+    overlap = max(len(pattern) for pattern in patterns) - 1
+    matches = {pattern: [] for pattern in patterns}
+    for start, end in ranges:
+        for block_start in range(start, end, stream_block_size):
+            block_end = min(block_start + stream_block_size, end)
+            block = content[block_start:min(block_end + overlap, end)]
+            for pattern, offsets in find_matches(block, patterns).items():
+                matches[pattern].extend(block_start + offset for offset in offsets
+                                        if offset < block_end - block_start)
+    return matches
+
+def read_pe_header(content):
+    # Minimal PE parser: finds the COFF characteristics field and the file ranges of the sections.
+    # Returns None if the content is not a PE file
+    try:
+        if bytes(content[:2]) != b"MZ":
+            return None
+        pe_offset = struct.unpack('<I', content[0x3C:0x40])[0]
+        if bytes(content[pe_offset:pe_offset + 4]) != b"PE\0\0":
+            return None
+        section_count, optional_header_size = struct.unpack('<2xH12xH', content[pe_offset + 4:pe_offset + 22])
+
+        sections = {}
+        section_table = pe_offset + 24 + optional_header_size
+        for index in range(section_count):
+            entry = section_table + 40 * index
+            name, raw_size, raw_offset = struct.unpack('<8s8xII', content[entry:entry + 24])
+            name = name.rstrip(b"\0").decode('latin-1')
+            sections.setdefault(name, []).append((raw_offset, min(raw_offset + raw_size, len(content))))
+    except struct.error:
+        return None
+    return {"characteristics_offset": pe_offset + 22, "sections": sections}
+
+def get_section_ranges(pe_header, sections, size):
+    # File ranges of the sections, or the whole file if the exe has none of them.
+    # The "header" section is the COFF characteristics with the optional header magic after them
+    ranges = []
+    if pe_header is not None:
+        for section in sections:
+            if section == "header":
+                offset = pe_header["characteristics_offset"]
+                ranges.append((offset, offset + 4))
+            else:
+                ranges.extend(pe_header["sections"].get(section, []))
+    return tuple(sorted(ranges)) or ((0, size),)
+
+def in_ranges(offset, length, ranges):
+    return any(start <= offset and offset + length <= end for start, end in ranges)
+
+def get_match_key(rule):
+    # Matches are kept by the search pattern and the sections it's searched in,
+    # as rules with the same pattern can be limited to different sections
+    return bytes.fromhex(rule.search), tuple(rule.sections)
+
+def get_table_key(match_key):
+    # Key of the offsets in the patch table, the pattern alone for the offsets in the whole file
+    pattern, sections = match_key
+    if not sections:
+        return pattern.hex()
+    return f"{pattern.hex()}:{','.join(sections)}"
+
+def get_pattern_ranges(content, rules):
+    # Ranges each search pattern of the rules is searched in, by match key
+    pe_header = read_pe_header(content)
+    return {get_match_key(rule): get_section_ranges(pe_header, rule.sections, len(content)) for rule in rules}
+
+def scan_patterns(content, match_keys, ranges):
+    # Patterns searched in the same ranges are found in one scan of them
+    groups = {}
+    for match_key in match_keys:
+        groups.setdefault(ranges[match_key], []).append(match_key)
+
+    matches = {}
+    scanned = sum(end - start for group_ranges in groups for start, end in group_ranges)
+    with timed_phase("scan", bytes=scanned, patterns=len(set(match_keys))):
+        for group_ranges, group in groups.items():
+            patterns = list({pattern for pattern, _ in group})
+            if isinstance(content, FileContent):
+                found = find_matches_in_blocks(content, patterns, group_ranges)
+            else:
+                found = find_matches(content, patterns, group_ranges)
+            matches.update((match_key, found[match_key[0]]) for match_key in group)
+    return matches
+
+def get_patch_tables_paths():
+    # Tables shipped next to the patch come first, the ones made while patching are kept in the cache
+    return [os.path.join(os.path.dirname(os.path.abspath(__file__)), "patch_tables.json"),
+            os.path.join(get_cache_dir(), "patch_tables.json")]
+
+def load_patch_tables():
+    # Patch tables: offsets of the search patterns in each known exe, by CRC.
+    # The CRC pins the exact file, so the patterns are always found at the same offsets
+    return load_tables(get_patch_tables_paths())
+
+def load_tables(tables_paths):
+    # Tables by CRC, merged from all the paths
+    tables = {}
+    for tables_path in tables_paths:
+        try:
+            with open(tables_path) as file:
+                for crc, table in json.load(file).items():
+                    tables.setdefault(crc, {}).update(table)
+        except (OSError, ValueError):
+            pass
+    return tables
+
+def save_patch_tables(new_tables, tables_path=None):
+    if tables_path is None:
+        tables_path = get_patch_tables_paths()[-1]
+    save_tables(new_tables, tables_path)
+
+def save_tables(new_tables, tables_path):
+    # The tables only save time, not being able to write them is fine
+    try:
+        tables = {}
+        if os.path.isfile(tables_path):
+            with open(tables_path) as file:
+                tables = json.load(file)
+        for crc, table in new_tables.items():
+            tables.setdefault(crc, {}).update(table)
+
+        os.makedirs(os.path.dirname(os.path.abspath(tables_path)), exist_ok=True)
+        temp_path = f"{tables_path}.{os.getpid()}.tmp"
+        with open(temp_path, 'w') as file:
+            json.dump(tables, file, indent=1, sort_keys=True)
+        os.replace(temp_path, tables_path)
+    except (OSError, ValueError):
+        pass
+
+def find_rule_matches(content, rules, calculated_crc=None):
+    # Offsets of the search patterns of the rules, by match key.
+    # For a file with known CRC they come from the patch table, the file is only scanned
+    # for the patterns that are not in the table yet, and those are added to it
+    rules = [Rule(*rule) for rule in rules]
+    ranges = get_pattern_ranges(content, rules)
+    match_keys = list(ranges)
+    if calculated_crc is None:
+        return scan_patterns(content, match_keys, ranges)
+
+    table = load_patch_tables().get(str(calculated_crc), {})
+    matches = {}
+    missing = []
+    for match_key in match_keys:
+        pattern = match_key[0]
+        # Offsets in the whole file (from --build-tables) do for any sections
+        offsets = table.get(get_table_key(match_key), table.get(pattern.hex()))
+        if offsets is not None and \
+                all(content[offset:offset + len(pattern)] == pattern for offset in offsets):
+            matches[match_key] = [offset for offset in offsets
+                                  if in_ranges(offset, len(pattern), ranges[match_key])]
+        else:
+            missing.append(match_key)
+
+    if missing:
+        matches.update(scan_patterns(content, missing, ranges))
+        save_patch_tables({str(calculated_crc): {get_table_key(match_key): matches[match_key]
+                                                 for match_key in missing}})
+    return matches
+
+def edits_overlap(start, end, edits):
+    for offset, data in edits:
+        if offset < end and offset + len(data) > start:
+            return True
+    return False
+
+def current_bytes(content, start, end, edits):
+    # Bytes of the range as they are after the edits made so far
+    window = bytearray(content[start:end])
+    for offset, data in edits:
+        if offset < end and offset + len(data) > start:
+            data_start = max(start - offset, 0)
+            data_end = min(end - offset, len(data))
+            window_start = offset + data_start - start
+            window[window_start:window_start + data_end - data_start] = data[data_start:data_end]
+    return window
+
+def plan_edits(content, rules, matches=None):
+    # Works out the (offset, bytes) edits that chained bytes.replace calls would make,
+    # using the offsets of all the patterns found in a single scan of the original content.
+    # Earlier replacements can create or break matches for the later rules,
+    # so the bytes around each edit made so far are searched again for every rule.
+    rules = [Rule(*rule) for rule in rules]
+    for rule in rules:
+        if len(rule.search) != len(rule.replace):
+            raise ValueError(f"Replacement for {rule.search.lower()} has a different length.")
+
+    if matches is None:
+        matches = find_rule_matches(content, rules)
+    ranges = get_pattern_ranges(content, rules)
+    pe_header = read_pe_header(content)
+
+    edits = []
+    counts = []
+    for rule in rules:
+        match_key = get_match_key(rule)
+        search = match_key[0]
+        replace = bytes.fromhex(rule.replace)
+        # The LAA fix is timed on its own, the other rules by their search pattern
+        phase_name = "laa" if rule == laa_rule else "rule"
+        with timed_phase(phase_name, search=search.hex()) as phase:
+            length = len(search)
+
+            if rule == laa_rule and pe_header is not None:
+                # The flag is set right in the header, whatever the other characteristics are
+                offset = pe_header["characteristics_offset"]
+                characteristics = struct.unpack('<H', current_bytes(content, offset, offset + 2, edits))[0]
+                phase["bytes"] = 0
+                if not characteristics & laa_flag:
+                    edits.append((offset, struct.pack('<H', characteristics | laa_flag)))
+                    phase["bytes"] = 2
+                # A flag that is already set counts as the match of the rule, there's nothing to be fixed
+                phase["matches"] = 1
+                counts.append(1)
+                continue
+
+            candidates = set()
+            for offset in matches[match_key]:
+                if not edits_overlap(offset, offset + length, edits):
+                    candidates.add(offset)
+
+            windows = []
+            for offset, data in sorted(edits):
+                start = max(offset - length + 1, 0)
+                end = min(offset + len(data) + length - 1, len(content))
+                if windows and start <= windows[-1][1]:
+                    windows[-1][1] = max(windows[-1][1], end)
+                else:
+                    windows.append([start, end])
+            for start, end in windows:
+                window = current_bytes(content, start, end, edits)
+                found = window.find(search)
+                while found != -1:
+                    if in_ranges(start + found, length, ranges[match_key]):
+                        candidates.add(start + found)
+                    found = window.find(search, found + 1)
+
+            # Same as bytes.replace, matches are taken from left to right without overlapping
+            count = 0
+            next_offset = 0
+            for offset in sorted(candidates):
+                if offset >= next_offset:
+                    edits.append((offset, replace))
+                    next_offset = offset + length
+                    count += 1
+            phase["matches"] = count
+            phase["bytes"] = count * length
+        counts.append(count)
+
+    return edits, counts
+
+def get_count_keys(rules):
+    # Expected counts are kept by the search pattern and the position of the rule among the ones
+    # with the same pattern, so they are the same for any resolution and with or without the LAA fix
+    keys = []
+    seen = collections.Counter()
+    for rule in rules:
+        search = Rule(*rule).search.lower()
+        keys.append(f"{search}#{seen[search]}")
+        seen[search] += 1
+    return keys
+
+def audit_counts(rules, counts, calculated_crc=None):
+    # Rules that didn't have as many matches as expected, the counts come from the scan of the patching
+    expected_counts = load_patch_tables().get(str(calculated_crc), {}).get("rule_counts", {})
+    problems = []
+    for rule, key, count in zip(rules, get_count_keys(rules), counts):
+        rule = Rule(*rule)
+        expected = rule.count
+        if expected is None:
+            expected = expected_counts.get(key)
+        if count == 0 if expected is None else count != expected:
+            problems.append({"search": rule.search.lower(), "matches": count,
+                             "expected": "1 or more" if expected is None else expected})
+    return problems
+
+def check_counts(rules, counts, calculated_crc=None, strict=False):
+    # In strict mode, wrong numbers of matches stop the patching before anything is written
+    problems = audit_counts(rules, counts, calculated_crc)
+    if strict and problems:
+        raise ValueError("Wrong number of matches, nothing was written: " +
+                         ", ".join(f"{problem['search']} matched {problem['matches']} times "
+                                   f"({problem['expected']} expected)" for problem in problems))
+    return problems
+
+def apply_edits(content, edits):
+    for offset, data in edits:
+        content[offset:offset + len(data)] = data
+
+def get_undo_entries(content, edits):
+    # [offset, original bytes, new bytes] of each edit, the original bytes being
+    # the ones it replaces after the edits before it are made
+    entries = []
+    for index, (offset, data) in enumerate(edits):
+        original = current_bytes(content, offset, offset + len(data), edits[:index])
+        entries.append([offset, original.hex(), data.hex()])
+    return entries
+
+def patch_content(content, rules, calculated_crc=None, undo_entries=None):
+    # Applies all the rules to the mutable content in one scan,
+    # the result is the same as chaining bytes.replace calls.
+    # The entries of the undo journal are added to undo_entries if it's given
+    edits, counts = plan_edits(content, rules, find_rule_matches(content, rules, calculated_crc))
+    if undo_entries is not None:
+        undo_entries.extend(get_undo_entries(content, edits))
+    with timed_phase("apply", bytes=sum(len(data) for _, data in edits)):
+        apply_edits(content, edits)
+    return counts
+
+def sync_directory(path):
+    # Makes a rename in the directory durable, not supported on Windows
+    if os.name != 'nt':
+        fd = os.open(os.path.dirname(os.path.abspath(path)), os.O_RDONLY)
+        try:
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+
+def write_file_atomic(file_path, content):
+    # Writes to a temporary file first and renames it over the original,
+    # so a crash leaves either the old or the new file, never a truncated one
+    temp_path = f"{file_path}.tmp"
+    with timed_phase("write", bytes=len(content)):
+        with open(temp_path, 'wb') as file:
+            file.write(content)
+            file.flush()
+            os.fsync(file.fileno())
+        shutil.copymode(file_path, temp_path)
+        os.replace(temp_path, file_path)
+        sync_directory(file_path)
+
+def clone_file(source_path, target_path):
+    # Reflink where the filesystem supports it (btrfs, XFS), so the data is shared until changed.
+    # A plain copy otherwise
+    if sys.platform.startswith('linux'):
+        import fcntl
+
+        try:
+            with open(source_path, 'rb') as source, open(target_path, 'wb') as target:
+                fcntl.ioctl(target.fileno(), 0x40049409, source.fileno()) # FICLONE
+            return
+        except OSError:
+            pass
+    shutil.copyfile(source_path, target_path)
+
+def clone_over(source_path, target_path):
+    # Replaces the target with a copy of the source that is not linked to it
+    temp_path = f"{target_path}.{os.getpid()}.tmp"
+    clone_file(source_path, temp_path)
+    if os.path.isfile(target_path):
+        shutil.copymode(target_path, temp_path)
+    os.replace(temp_path, target_path)
+
+def write_journal(journal_path, journal):
+    temp_path = f"{journal_path}.tmp"
+    with open(temp_path, 'w') as file:
+        json.dump(journal, file)
+        file.flush()
+        os.fsync(file.fileno())
+    os.replace(temp_path, journal_path)
+    sync_directory(journal_path)
+
+def get_undo_journal_path(file_path):
+    return f"{file_path}.undo"
+
+def save_undo_journal(file_path, undo):
+    # Journal of the edits of the last patch, so it can be undone without the backup.
+    # Without one, the journal of an earlier patch is removed as it doesn't match the exe anymore
+    undo_path = get_undo_journal_path(file_path)
+    if undo is not None:
+        write_journal(undo_path, undo)
+    elif os.path.isfile(undo_path):
+        os.remove(undo_path)
+
+def read_undo_journal(file_path):
+    # Returns the undo journal of the exe, or None if there's none or the exe is not as the journal left it.
+    # An interrupted patch or an exe sharing its bytes with the backup store doesn't match the journal
+    try:
+        with open(get_undo_journal_path(file_path)) as file:
+            journal = json.load(file)
+        if os.path.getsize(file_path) != journal["size"] or os.stat(file_path).st_nlink > 1 \
+                or os.path.isfile(f"{file_path}.journal"):
+            return None
+        with open(file_path, 'rb') as file:
+            if get_original_bytes(file, journal["edits"]) is None:
+                return None
+    except (OSError, ValueError, KeyError):
+        return None
+    return journal
+
+def get_original_bytes(file, entries):
+    # Goes back through the edits from the last one, returns the original bytes of the patched sites
+    # by offset, or None if the sites don't have the bytes the edits left there
+    sites = {}
+    for offset, _, data in entries:
+        file.seek(offset)
+        sites.update(zip(range(offset, offset + len(data) // 2), file.read(len(data) // 2)))
+    for offset, original, data in reversed(entries):
+        data = bytes.fromhex(data)
+        if bytes(sites[offset + index] for index in range(len(data))) != data:
+            return None
+        sites.update(zip(range(offset, offset + len(data)), bytes.fromhex(original)))
+    return sites
+
+def get_repatch_entries(content, sites, edits):
+    # Entries that take the exe from its last patch to the new one: each site of either patch
+    # gets the byte of the new patch, or its original byte. Only the bytes that change are written
+    final = dict(sites)
+    for offset, data in edits:
+        final.update(zip(range(offset, offset + len(data)), data))
+    entries = []
+    for offset in sorted(final):
+        current = content[offset]
+        if current == final[offset]:
+            continue
+        if entries and entries[-1][0] + len(entries[-1][1]) == offset:
+            entries[-1][1].append(current)
+            entries[-1][2].append(final[offset])
+        else:
+            entries.append([offset, bytearray([current]), bytearray([final[offset]])])
+    return [[offset, original.hex(), data.hex()] for offset, original, data in entries]
+
+def undo_patch(file_path):
+    # Writes the original bytes back to the patched sites from the undo journal,
+    # so the exe is restored without copying the backup.
+    # Returns the journal, or None if the exe is not as the journal left it
+    journal = read_undo_journal(file_path)
+    if journal is None:
+        return None
+
+    with open(file_path, 'r+b') as file:
+        sites = get_original_bytes(file, journal["edits"])
+        with timed_phase("restore", bytes=len(sites)):
+            runs = []
+            for offset in sorted(sites):
+                if runs and runs[-1][0] + len(runs[-1][1]) == offset:
+                    runs[-1][1].append(sites[offset])
+                else:
+                    runs.append((offset, bytearray([sites[offset]])))
+            for offset, data in runs:
+                file.seek(offset)
+                file.write(data)
+            file.flush()
+            os.fsync(file.fileno())
+    os.remove(get_undo_journal_path(file_path))
+    return journal
+
+@contextlib.contextmanager
+def edit_file(file_path, in_place=False, stream=False):
+    # Opens the file the way it's going to be written: through a memory map with in_place,
+    # so only the pages with patched bytes are written; in blocks with stream, so the memory used
+    # doesn't grow with its size; otherwise read as a whole and written over the file atomically.
+    # Yields the content and the function that writes the edits with their undo journal,
+    # nothing is written if the block raises before calling it
+    if in_place:
+        # A hardlinked exe shares its bytes with a stored backup, so it gets a copy of its own first
+        if os.stat(file_path).st_nlink > 1:
+            clone_over(file_path, file_path)
+        with open(file_path, 'r+b') as file:
+            with mmap.mmap(file.fileno(), 0) as content:
+                yield content, functools.partial(write_edits_in_place, file_path, content)
+    elif stream:
+        with open(file_path, 'rb') as file:
+            content = FileContent(file)
+            yield content, functools.partial(write_edits_streaming, file_path, content)
+    else:
+        content = read_content(file_path)
+        yield content, functools.partial(write_edits, file_path, content)
+
+def write_edits_in_place(file_path, content, edits, undo=None):
+    # Writes the edits to the memory map of the file, after saving them to the journal.
+    # If the run is interrupted, the next one finishes it with finish_interrupted_patch()
+    journal_path = f"{file_path}.journal"
+    with timed_phase("journal", edits=len(edits)):
+        entries = get_undo_entries(content, edits)
+        write_journal(journal_path, {"size": len(content), "edits": entries, "undo": undo})
+        save_undo_journal(file_path, undo)
+
+    with timed_phase("write", bytes=sum(len(data) for _, data in edits)):
+        apply_edits(content, edits)
+        content.flush()
+    os.remove(journal_path)
+
+def finish_interrupted_patch(file_path):
+    journal_path = f"{file_path}.journal"
+    if not os.path.isfile(journal_path):
+        return False
+
+    try:
+        with open(journal_path) as file:
+            journal = json.load(file)
+        matches = journal_matches(file_path, journal)
+    except (ValueError, KeyError, TypeError):
+        matches = False
+    if not matches:
+        # Left from another exe or a patch that was undone since, writing it would break the exe
+        print("Removing the journal of an interrupted patch, the exe doesn't match it")
+        os.remove(journal_path)
+        return False
+    # Edits are written again from the start, which is safe as they don't depend on the current bytes
+    with open(file_path, 'r+b') as file:
+        with mmap.mmap(file.fileno(), 0) as content:
+            apply_edits(content, [(offset, bytes.fromhex(data)) for offset, _, data in journal["edits"]])
+            content.flush()
+    if "undo" in journal:
+        save_undo_journal(file_path, journal["undo"])
+    os.remove(journal_path)
+    return True
+
+def journal_matches(file_path, journal):
+    # Each patched byte has to be as it was before the patch, or as one of the edits left it,
+    # as the run could stop anywhere in the middle of writing them
+    size = os.path.getsize(file_path)
+    if journal.get("size", size) != size:
+        return False
+    allowed = {}
+    for offset, original, data in journal["edits"]:
+        original, data = bytes.fromhex(original), bytes.fromhex(data)
+        if offset < 0 or offset + len(data) > size or len(original) != len(data):
+            return False
+        for index in range(len(data)):
+            allowed.setdefault(offset + index, {original[index]}).add(data[index])
+    with open(file_path, 'rb') as file:
+        for offset, values in allowed.items():
+            file.seek(offset)
+            if file.read(1)[0] not in values:
+                return False
+    return True
+
+def write_edits_streaming(file_path, content, edits, undo=None):
+    # Writes the file content with the edits to a temporary file block by block and renames it over the file
+    save_undo_journal(file_path, None)
+    temp_path = f"{file_path}.tmp"
+    with timed_phase("write", bytes=len(content)):
+        with open(temp_path, 'wb') as file:
+            for block_start in range(0, len(content), stream_block_size):
+                block_end = min(block_start + stream_block_size, len(content))
+                file.write(current_bytes(content, block_start, block_end, edits))
+            file.flush()
+            os.fsync(file.fileno())
+        shutil.copymode(file_path, temp_path)
+        os.replace(temp_path, file_path)
+        sync_directory(file_path)
+    save_undo_journal(file_path, undo)
+
+def write_edits(file_path, content, edits, undo=None):
+    # Makes the edits in the content and writes it over the file
+    with timed_phase("apply", bytes=sum(len(data) for _, data in edits)):
+        apply_edits(content, edits)
+    save_undo_journal(file_path, None)
+    write_file_atomic(file_path, content)
+    save_undo_journal(file_path, undo)
+
+def patch_file(file_path, rules, in_place=False, calculated_crc=None, undo_info=None, strict=False, stream=False):
+    # With the CRC of the file, patch sites are taken from the patch table instead of scanning the file.
+    # With undo_info, the edits are saved to the undo journal along with it.
+    # With strict, ValueError is raised before writing if a rule has a wrong number of matches.
+    # With stream, the file is never loaded as a whole (in place patching doesn't load it either)
+    with edit_file(file_path, in_place, stream) as (content, write):
+        edits, counts = plan_edits(content, rules, find_rule_matches(content, rules, calculated_crc))
+        check_counts(rules, counts, calculated_crc, strict)
+        undo = None
+        if undo_info is not None:
+            undo = {**undo_info, "size": len(content), "edits": get_undo_entries(content, edits)}
+        write(edits, undo)
+    return counts
+
+def get_config_dir():
+    if os.environ.get("TYCOON_PATCH_CONFIG"):
+        return os.environ["TYCOON_PATCH_CONFIG"]
+    if os.name == 'nt' and os.environ.get("APPDATA"):
+        return os.path.join(os.environ["APPDATA"], "tycoon_patch")
+    config_home = os.environ.get("XDG_CONFIG_HOME") or os.path.join(os.path.expanduser("~"), ".config")
+    return os.path.join(config_home, "tycoon_patch")
+
+def parse_resolution(res):
+    nums = res.lower().split('x')
+    if len(nums) != 2 or not all(num.strip().isdigit() for num in nums):
+        raise ValueError(f"{res} is not a resolution, it should look like 1920x1080.")
+    return int(nums[0]), int(nums[1])
+
+def get_resolution_override():
+    # Resolution set in TYCOON_PATCH_RESOLUTION or in config.json of the config folder,
+    # used instead of the one of the display, for headless runs and displays that can't be queried
+    if os.environ.get("TYCOON_PATCH_RESOLUTION"):
+        return parse_resolution(os.environ["TYCOON_PATCH_RESOLUTION"])
+    try:
+        with open(os.path.join(get_config_dir(), "config.json")) as file:
+            res = json.load(file).get("resolution")
+    except (OSError, ValueError, AttributeError):
+        return None
+    return parse_resolution(res) if res else None
+
+def get_display_name():
+    # Resolutions are cached per display, on X11 that's the one in DISPLAY
+    if os.name == 'nt' or sys.platform == 'darwin':
+        return None
+    return os.environ.get("DISPLAY")
+
+def load_library(name):
+    import ctypes
+    import ctypes.util
+
+    library_path = ctypes.util.find_library(name)
+    if library_path is None:
+        raise OSError(f"lib{name} is not found")
+    return ctypes.CDLL(library_path)
+
+@contextlib.contextmanager
+def open_x_display(display_name):
+    # Connection to the X server through Xlib, without any GUI toolkit
+    import ctypes
+
+    if not display_name:
+        raise OSError("DISPLAY is not set")
+    x11 = load_library("X11")
+    x11.XOpenDisplay.restype = ctypes.c_void_p
+    x11.XOpenDisplay.argtypes = [ctypes.c_char_p]
+    x11.XCloseDisplay.argtypes = [ctypes.c_void_p]
+    display = x11.XOpenDisplay(display_name.encode())
+    if not display:
+        raise OSError(f"Can't open display {display_name}")
+    try:
+        yield x11, display
+    finally:
+        x11.XCloseDisplay(display)
+
+def get_x_resolution(display_name):
+    # Size of the default screen, the same that GUI toolkits report
+    import ctypes
+
+    with open_x_display(display_name) as (x11, display):
+        x11.XDefaultScreen.argtypes = [ctypes.c_void_p]
+        x11.XDisplayWidth.argtypes = [ctypes.c_void_p, ctypes.c_int]
+        x11.XDisplayHeight.argtypes = [ctypes.c_void_p, ctypes.c_int]
+        screen = x11.XDefaultScreen(display)
+        return x11.XDisplayWidth(display, screen), x11.XDisplayHeight(display, screen)
+
+def get_x_modes(display_name):
+    # Modes of all the outputs of the screen from XRandR
+    import ctypes
+
+    class XRRModeInfo(ctypes.Structure):
+        _fields_ = [("id", ctypes.c_ulong), ("width", ctypes.c_uint), ("height", ctypes.c_uint),
+                    ("dotClock", ctypes.c_ulong), ("hSyncStart", ctypes.c_uint), ("hSyncEnd", ctypes.c_uint),
+                    ("hTotal", ctypes.c_uint), ("hSkew", ctypes.c_uint), ("vSyncStart", ctypes.c_uint),
+                    ("vSyncEnd", ctypes.c_uint), ("vTotal", ctypes.c_uint), ("name", ctypes.c_char_p),
+                    ("nameLength", ctypes.c_uint), ("modeFlags", ctypes.c_ulong)]
+
+    class XRRScreenResources(ctypes.Structure):
+        _fields_ = [("timestamp", ctypes.c_ulong), ("configTimestamp", ctypes.c_ulong),
+                    ("ncrtc", ctypes.c_int), ("crtcs", ctypes.POINTER(ctypes.c_ulong)),
+                    ("noutput", ctypes.c_int), ("outputs", ctypes.POINTER(ctypes.c_ulong)),
+                    ("nmode", ctypes.c_int), ("modes", ctypes.POINTER(XRRModeInfo))]
+
+    xrandr = load_library("Xrandr")
+    xrandr.XRRGetScreenResources.restype = ctypes.POINTER(XRRScreenResources)
+    xrandr.XRRGetScreenResources.argtypes = [ctypes.c_void_p, ctypes.c_ulong]
+    xrandr.XRRFreeScreenResources.argtypes = [ctypes.POINTER(XRRScreenResources)]
+    with open_x_display(display_name) as (x11, display):
+        x11.XDefaultRootWindow.restype = ctypes.c_ulong
+        x11.XDefaultRootWindow.argtypes = [ctypes.c_void_p]
+        resources = xrandr.XRRGetScreenResources(display, x11.XDefaultRootWindow(display))
+        if not resources:
+            raise OSError("XRandR has no screen resources")
+        try:
+            return {(mode.width, mode.height) for mode in resources.contents.modes[:resources.contents.nmode]}
+        finally:
+            xrandr.XRRFreeScreenResources(resources)
+
+def get_windows_modes():
+    import ctypes
+    from ctypes import wintypes
+
+    class DEVMODEW(ctypes.Structure):
+        _fields_ = [("dmDeviceName", wintypes.WCHAR * 32), ("dmSpecVersion", wintypes.WORD),
+                    ("dmDriverVersion", wintypes.WORD), ("dmSize", wintypes.WORD),
+                    ("dmDriverExtra", wintypes.WORD), ("dmFields", wintypes.DWORD),
+                    ("dmPosition", ctypes.c_byte * 16), ("dmColor", ctypes.c_short),
+                    ("dmDuplex", ctypes.c_short), ("dmYResolution", ctypes.c_short),
+                    ("dmTTOption", ctypes.c_short), ("dmCollate", ctypes.c_short),
+                    ("dmFormName", wintypes.WCHAR * 32), ("dmLogPixels", wintypes.WORD),
+                    ("dmBitsPerPel", wintypes.DWORD), ("dmPelsWidth", wintypes.DWORD),
+                    ("dmPelsHeight", wintypes.DWORD), ("dmDisplayFlags", wintypes.DWORD),
+                    ("dmDisplayFrequency", wintypes.DWORD), ("dmICMMethod", wintypes.DWORD),
+                    ("dmICMIntent", wintypes.DWORD), ("dmMediaType", wintypes.DWORD),
+                    ("dmDitherType", wintypes.DWORD), ("dmReserved1", wintypes.DWORD),
+                    ("dmReserved2", wintypes.DWORD), ("dmPanningWidth", wintypes.DWORD),
+                    ("dmPanningHeight", wintypes.DWORD)]
+
+    modes = set()
+    devmode = DEVMODEW(dmSize=ctypes.sizeof(DEVMODEW))
+    mode_number = 0
+    while ctypes.windll.user32.EnumDisplaySettingsW(None, mode_number, ctypes.byref(devmode)):
+        modes.add((devmode.dmPelsWidth, devmode.dmPelsHeight))
+        mode_number += 1
+    return modes
+
+def get_mac_resolution():
+    import ctypes
+
+    core_graphics = load_library("CoreGraphics")
+    core_graphics.CGMainDisplayID.restype = ctypes.c_uint32
+    core_graphics.CGDisplayPixelsWide.argtypes = [ctypes.c_uint32]
+    core_graphics.CGDisplayPixelsHigh.argtypes = [ctypes.c_uint32]
+    display = core_graphics.CGMainDisplayID()
+    return core_graphics.CGDisplayPixelsWide(display), core_graphics.CGDisplayPixelsHigh(display)
+
+@functools.lru_cache(maxsize=None)
+def detect_resolution(display_name=None):
+    # Resolution of the display, queried straight from the system through ctypes.
+    # Cached, so each display is only queried once
+    if os.name == 'nt':
+        import ctypes
+
+        user32 = ctypes.windll.user32
+        return user32.GetSystemMetrics(0), user32.GetSystemMetrics(1)
+    try:
+        if sys.platform == 'darwin':
+            return get_mac_resolution()
+        return get_x_resolution(display_name)
+    except (OSError, AttributeError) as error:
+        raise ValueError(f"Screen resolution can't be detected: {error}. Set it with (width)x(height) argument, "
+                         f"TYCOON_PATCH_RESOLUTION or \"resolution\" in "
+                         f"\"{os.path.join(get_config_dir(), 'config.json')}\".")
+
+@functools.lru_cache(maxsize=None)
+def get_display_modes(display_name=None):
+    # All the resolutions the display supports, the tested ones first
+    if os.name == 'nt':
+        modes = get_windows_modes()
+    elif sys.platform == 'darwin':
+        modes = {get_mac_resolution()}
+    else:
+        modes = get_x_modes(display_name)
+    tested = [mode for mode in tested_resolutions.values() if mode in modes]
+    return tested + sorted(modes.difference(tested))
 
+def get_res(res=False):
     if res:
         print("Using user-defined resolution")
-        nums = res.split('x')
-        if len(nums) == 2:
-            width = int(nums[0])
-            height = int(nums[1])
+        width, height = parse_resolution(res)
     else:
-        # Using resolution of current display
-        if os.name == 'nt':
-            import ctypes
-
-            user32 = ctypes.windll.user32
-            width = user32.GetSystemMetrics(0)
-            height = user32.GetSystemMetrics(1)
+        override = get_resolution_override()
+        if override:
+            print("Using resolution from the settings")
+            width, height = override
         else:
-            try:
-                import pyautogui
-
-                # Get the screen resolution using pyautogui
-                width, height = pyautogui.size()
-            except:
-                print("Install pyautogui to detect screen size: pip install pyautogui")
+            # Using resolution of current display
+            width, height = detect_resolution(get_display_name())
 
     print(f"Changing resolution to {width}x{height}")
 
@@ -128,8 +1148,514 @@ def get_res(res=False):
 
     return width, height
 
-def restore_backup():
+@functools.lru_cache(maxsize=None)
+def get_rule_pack(game_name):
+    return importlib.import_module(game_index[game_name]["pack"])
+
+def get_game_rules(game_name, calculated_crc, width, height):
+    # Returns the rules for the game,
+    # in the order they have to be applied
+    rules = get_rule_pack(game_name).get_rules(game_name, calculated_crc, width, height)
+    # Unless a rule says otherwise, it patches the code
+    return [Rule(*rule) for rule in rules]
+
+def get_disk_check_rules(game_name):
+    rules = get_rule_pack(game_name).get_disk_check_rules(game_name)
+    # Expected counts are learned from the original exe, as for the rules of the game
+    return [Rule(search, replace) for search, replace in rules]
+
+def get_laa_rules(width, height, laa_true=False, laa_false=False):
+    # Applying LAA fix (4GB patch) if needed
+    # So far it is the same line for all the games
+    rules = []
+    if not laa_false:
+        if (width >= 2560 or height >= 1440) or laa_true:
+            print("LAA fix for better stability")
+            rules.append(laa_rule)
+    else:
+        if (width >= 2560 or height >= 1440):
+            print("LAA fix is disabled, things may be unstable")
+    return rules
+
+def get_cracked_crc(calculated_crc):
+    # CRC of the copy protected exe once its disk check is removed, as given by the game index
+    return cracked_crcs[calculated_crc]
+
+def get_patch_rules(calculated_crc, width, height, laa_true=False, laa_false=False):
+    # For an exe with disk check, it's removed first and the rest are the rules of the exe without it,
+    # so both are done in one pass
+    rules = []
+    if calculated_crc in copy_protected_crcs:
+        rules += get_disk_check_rules(copy_protected_crcs[calculated_crc])
+        calculated_crc = get_cracked_crc(calculated_crc)
+    rules += get_laa_rules(width, height, laa_true, laa_false)
+    rules += get_game_rules(known_crcs[calculated_crc], calculated_crc, width, height)
+    return rules
+
+def get_rule_patterns(calculated_crc):
+    # All the search patterns the rules can use for the exe, whatever the resolution
+    patterns = set()
+    if calculated_crc in known_crcs or calculated_crc in copy_protected_crcs:
+        with contextlib.redirect_stdout(io.StringIO()):
+            for width, height in tested_resolutions.values():
+                rules = get_patch_rules(calculated_crc, width, height, laa_true=True)
+                patterns.update(rule.search.lower() for rule in rules)
+    return sorted(patterns)
+
+def build_patch_tables(exe_paths, tables_path):
+    # Makes patch tables of the supported exes, to be shipped along with the patch
+    built = []
+    for exe_path in exe_paths:
+        calculated_crc = calculate_crc(exe_path)
+        patterns = get_rule_patterns(calculated_crc)
+        if patterns:
+            content = read_content(exe_path)
+            matches = find_matches(content, [bytes.fromhex(pattern) for pattern in patterns])
+            table = {pattern.hex(): offsets for pattern, offsets in matches.items()}
+            table["rule_counts"] = get_expected_counts(content, calculated_crc)
+            save_patch_tables({str(calculated_crc): table}, tables_path)
+        if get_game_name(calculated_crc):
+            fingerprints_path = os.path.join(os.path.dirname(os.path.abspath(tables_path)), "fingerprints.json")
+            save_tables({str(calculated_crc): make_fingerprint(exe_path, calculated_crc)}, fingerprints_path)
+            built.append(exe_path)
+    return built
+
+def get_expected_counts(content, calculated_crc):
+    # Numbers of matches the rules have in the original exe at each of the tested resolutions,
+    # with the LAA fix, for checking the patches made later.
+    # A rule whose count depends on the resolution gets none, at least one match is expected then
+    counts = {}
+    with contextlib.redirect_stdout(io.StringIO()):
+        for width, height in tested_resolutions.values():
+            rules = get_patch_rules(calculated_crc, width, height, laa_true=True)
+            for key, count in zip(get_count_keys(rules), plan_edits(content, rules)[1]):
+                counts[key] = count if counts.get(key, count) == count else None
+    return {key: count for key, count in counts.items() if count is not None}
+
+# Fingerprints identify an exe in a few small reads instead of hashing all of it.
+# Each one has checksums of regions the patches never touch, so the exe is recognized
+# when it's patched as well, then its patch sites tell what was done to it
+def get_fingerprints_paths():
+    return [os.path.join(os.path.dirname(os.path.abspath(__file__)), "fingerprints.json"),
+            os.path.join(get_cache_dir(), "fingerprints.json")]
+
+def get_stable_ranges(start, end, excluded):
+    # Parts of the range outside the excluded ranges, which are sorted
+    ranges = []
+    for excluded_start, excluded_end in excluded:
+        if excluded_end <= start or excluded_start >= end:
+            continue
+        if excluded_start > start:
+            ranges.append((start, excluded_start))
+        start = max(start, excluded_end)
+    if start < end:
+        ranges.append((start, end))
+    return ranges
+
+def make_fingerprint(file_path, calculated_crc):
+    # Checksums of the headers (with the section table) and of regions spread over the file,
+    # leaving out the bytes around the patch sites, as chained rules can patch next to them
+    patterns = get_rule_patterns(calculated_crc)
+    with map_content(file_path) as content:
+        # Patterns are looked for in the whole file, as any of their sites could be patched
+        matches = find_rule_matches(content, [Rule(pattern, pattern, ()) for pattern in patterns], calculated_crc)
+        margin = max((len(pattern) for pattern, _ in matches), default=0)
+        excluded = sorted((offset - margin, offset + len(pattern) + margin)
+                          for (pattern, _), offsets in matches.items() for offset in offsets)
+
+        regions = []
+        for index in range(fingerprint_regions):
+            start = len(content) * index // fingerprint_regions
+            end = min(start + fingerprint_region_size, len(content))
+            for region_start, region_end in get_stable_ranges(start, end, excluded):
+                regions.append([region_start, region_end - region_start,
+                                zlib.crc32(content[region_start:region_end])])
+        return {"size": len(content), "regions": regions}
+
+def read_resolution(file, calculated_crc, table):
+    # Reads the resolution the exe was patched to from the sites of the rules
+    # that have the width or the height in their replacement
+    game_name = known_crcs[calculated_crc]
+    with contextlib.redirect_stdout(io.StringIO()):
+        first_rules = get_game_rules(game_name, calculated_crc, 1920, 1080)
+        second_rules = {rule.search: rule.replace
+                        for rule in reversed(get_game_rules(game_name, calculated_crc, 2560, 1440))}
+
+    resolution = {}
+    for rule in first_rules:
+        search, replace = rule.search, rule.replace
+        offsets = table.get(search.lower())
+        if not offsets or search not in second_rules:
+            continue
+        replace = bytes.fromhex(replace)
+        second_replace = bytes.fromhex(second_rules[search])
+        for name, first_value, second_value in (("width", 1920, 2560), ("height", 1080, 1440)):
+            position = replace.find(struct.pack('<I', first_value))
+            if name not in resolution and position != -1 and \
+                    second_replace[position:position + 4] == struct.pack('<I', second_value):
+                file.seek(offsets[0] + position)
+                resolution[name] = struct.unpack('<I', file.read(4))[0]
+    if len(resolution) < 2:
+        return None
+    return f"{resolution['width']}x{resolution['height']}"
+
+def check_fingerprint(file, calculated_crc, fingerprint, table):
+    # Returns what was done to the exe if its stable regions match the fingerprint, otherwise None
+    for offset, length, region_crc in fingerprint["regions"]:
+        file.seek(offset)
+        if zlib.crc32(file.read(length)) != region_crc:
+            return None
+
+    identity = {"crc": calculated_crc, "game": get_game_name(calculated_crc), "state": "pristine",
+                "resolution": None, "laa": False, "crc_checked": False}
+    changed = set()
+    for pattern, offsets in table.items():
+        for offset in offsets:
+            file.seek(offset)
+            if file.read(len(pattern) // 2) != bytes.fromhex(pattern):
+                changed.add(pattern)
+    if changed:
+        # The CRC of the exe as it is now is not known
+        identity["crc"] = None
+        identity["state"] = "modified"
+        if calculated_crc in known_crcs:
+            identity["state"] = "patched"
+            identity["resolution"] = read_resolution(file, calculated_crc, table)
+            identity["laa"] = "0f010b01" in changed
+        elif calculated_crc in copy_protected_crcs:
+            disk_check_patterns = {rule.search.lower()
+                                   for rule in get_disk_check_rules(copy_protected_crcs[calculated_crc])}
+            if disk_check_patterns <= changed:
+                identity["state"] = "disk check removed"
+                if changed - disk_check_patterns:
+                    # Patched in the same pass as the disk check was removed
+                    identity["state"] = "patched"
+                    identity["resolution"] = read_resolution(file, get_cracked_crc(calculated_crc), table)
+                    identity["laa"] = "0f010b01" in changed
+    return identity
+
+def match_fingerprints(file, fingerprints):
+    # Identifies the opened exe by the fingerprints of its size, a pristine match wins over the others.
+    # Also returns whether a fingerprint of its size was left out, as the patch sites of that exe
+    # are not all known (a pack got new rules, for example), so the exe could still be that one
+    size = file.seek(0, os.SEEK_END)
+    tables = load_patch_tables()
+    identities = []
+    skipped = False
+    for crc, fingerprint in fingerprints.items():
+        if fingerprint["size"] != size or not get_game_name(int(crc)):
+            continue
+        table = {pattern: tables.get(crc, {}).get(pattern) for pattern in get_rule_patterns(int(crc))}
+        if None in table.values():
+            skipped = True
+            continue
+        identity = check_fingerprint(file, int(crc), fingerprint, table)
+        if identity is not None:
+            identities.append(identity)
+    identities.sort(key=lambda identity: identity["state"] != "pristine")
+    return identities[0] if identities else None, skipped
+
+def get_crc_identity(identity, calculated_crc):
+    # Identity of the exe by its CRC, keeping the state told by its fingerprint if there is one
+    if identity is not None:
+        identity.update(crc=calculated_crc, crc_checked=True)
+        return identity
+    game_name = get_game_name(calculated_crc) if calculated_crc is not None else None
+    return {"crc": calculated_crc, "game": game_name, "state": "pristine" if game_name else "unknown",
+            "resolution": None, "laa": False, "crc_checked": True}
+
+def identify_exe(file_path, cache=None):
+    # Identifies the exe by its fingerprint, the CRC of the whole file is only calculated
+    # when there is no fingerprint for it, or to tell what an exe with removed disk check became.
+    # A fingerprint match is enough to report the state or to reject a file, but the CRC it gives
+    # is checked with check_crc() before the exe is patched or backed up, "crc_checked" is False then.
+    # Returns the CRC of the exe (None if it's not known), the game, the state of the exe
+    # (pristine, patched, disk check removed, modified or unknown), and the resolution it was patched to
+    with timed_phase("fingerprint", bytes=0):
+        fingerprints = load_tables(get_fingerprints_paths())
+        with open(file_path, 'rb') as file:
+            identity, skipped = match_fingerprints(file, fingerprints)
+    if identity is not None and identity["state"] in ("pristine", "patched"):
+        return identity
+
+    all_crcs = set(known_crcs) | set(copy_protected_crcs) | set(old_crcs)
+    if identity is None and not skipped and all(str(crc) in fingerprints for crc in all_crcs):
+        # None of the supported exes, whatever was done to it
+        return {"crc": None, "game": None, "state": "unknown", "resolution": None, "laa": False,
+                "crc_checked": False}
+
+    calculated_crc = identify_crc(file_path, cache)
+    identity = get_crc_identity(identity, calculated_crc)
+    # Next time this exe is identified by its fingerprint
+    if calculated_crc is not None and get_game_name(calculated_crc) and str(calculated_crc) not in fingerprints:
+        save_tables({str(calculated_crc): make_fingerprint(file_path, calculated_crc)},
+                    get_fingerprints_paths()[-1])
+        # The CRC proves this is the original exe, so its counts are the ones to expect
+        if (calculated_crc in known_crcs or calculated_crc in copy_protected_crcs) and \
+                "rule_counts" not in load_patch_tables().get(str(calculated_crc), {}):
+            with map_content(file_path) as content:
+                counts = get_expected_counts(content, calculated_crc)
+            save_patch_tables({str(calculated_crc): {"rule_counts": counts}})
+    return identity
+
+# Deltas are saved in BPS format, so they can also be applied with the usual ROM patching tools
+def encode_number(number):
+    encoded = bytearray()
+    while True:
+        byte = number & 0x7F
+        number >>= 7
+        if number == 0:
+            encoded.append(0x80 | byte)
+            return encoded
+        encoded.append(byte)
+        number -= 1
+
+def decode_number(delta, offset):
+    number = 0
+    shift = 1
+    while True:
+        byte = delta[offset]
+        offset += 1
+        number += (byte & 0x7F) * shift
+        if byte & 0x80:
+            return number, offset
+        shift <<= 7
+        number += shift
+
+def make_delta(source, edits, metadata=""):
+    # Delta from the original content to the content with the edits applied.
+    # Only the changed bytes are stored, everything else is read from the source
+    target = bytearray(source)
+    apply_edits(target, edits)
+
+    changed = []
+    for offset, data in sorted(edits):
+        for position in range(offset, offset + len(data)):
+            if source[position] == target[position]:
+                continue
+            if changed and changed[-1][1] >= position:
+                changed[-1][1] = max(changed[-1][1], position + 1)
+            else:
+                changed.append([position, position + 1])
+
+    metadata = metadata.encode()
+    delta = bytearray(b"BPS1")
+    delta += encode_number(len(source))
+    delta += encode_number(len(target))
+    delta += encode_number(len(metadata))
+    delta += metadata
+
+    position = 0
+    for start, end in changed:
+        if start > position:
+            # SourceRead
+            delta += encode_number((start - position - 1) << 2 | 0)
+        # TargetRead
+        delta += encode_number((end - start - 1) << 2 | 1)
+        delta += target[start:end]
+        position = end
+    if position < len(target):
+        delta += encode_number((len(target) - position - 1) << 2 | 0)
+
+    delta += struct.pack('<II', zlib.crc32(source), zlib.crc32(target))
+    delta += struct.pack('<I', zlib.crc32(delta))
+    return bytes(delta)
+
+def read_delta_metadata(delta):
+    _, offset = decode_number(delta, 4)
+    _, offset = decode_number(delta, offset)
+    metadata_size, offset = decode_number(delta, offset)
+    return delta[offset:offset + metadata_size].decode()
+
+def apply_delta(source, delta):
+    # Returns the target content, checking the source and the result against the CRCs in the delta
+    if delta[:4] != b"BPS1" or zlib.crc32(delta[:-4]) != struct.unpack('<I', delta[-4:])[0]:
+        raise ValueError("Delta file is damaged.")
+    source_crc, target_crc = struct.unpack('<II', delta[-12:-4])
+    if zlib.crc32(source) != source_crc:
+        raise ValueError(f"Delta is made for another file, its CRC is {source_crc}.")
+
+    source_size, offset = decode_number(delta, 4)
+    target_size, offset = decode_number(delta, offset)
+    metadata_size, offset = decode_number(delta, offset)
+    offset += metadata_size
+    if source_size != len(source):
+        raise ValueError("Delta is made for a file of another size.")
+
+    target = bytearray(target_size)
+    position = 0
+    source_relative = 0
+    target_relative = 0
+    while offset < len(delta) - 12:
+        data, offset = decode_number(delta, offset)
+        action = data & 3
+        length = (data >> 2) + 1
+        if action == 0:
+            target[position:position + length] = source[position:position + length]
+        elif action == 1:
+            target[position:position + length] = delta[offset:offset + length]
+            offset += length
+        else:
+            data, offset = decode_number(delta, offset)
+            relative = -(data >> 1) if data & 1 else data >> 1
+            if action == 2:
+                source_relative += relative
+                target[position:position + length] = source[source_relative:source_relative + length]
+                source_relative += length
+            else:
+                target_relative += relative
+                # Byte by byte, as the copied range may overlap the one being written
+                for index in range(length):
+                    target[position + index] = target[target_relative]
+                    target_relative += 1
+        position += length
+
+    if zlib.crc32(target) != target_crc:
+        raise ValueError("Patched file doesn't match the delta.")
+    return target
+
+def get_delta_metadata(calculated_crc, width, height, rules):
+    return {
+        "game": get_game_name(calculated_crc),
+        "crc": calculated_crc,
+        "resolution": f"{width}x{height}",
+        "laa": laa_rule in rules
+    }
+
+def apply_delta_file(game_path, delta_path):
+    with open(delta_path, 'rb') as file:
+        delta = file.read()
+    target = apply_delta(read_content(game_path), delta)
+    source_crc = struct.unpack('<I', delta[-12:-8])[0]
+    backup_original(game_path, source_crc)
+    remember_installs({game_path: source_crc})
+    write_file_atomic(game_path, target)
+    return json.loads(read_delta_metadata(delta) or "{}")
+
+def export_delta(game_path, delta_path, calculated_crc, width, height, laa_true=False, laa_false=False):
+    # Saves the changes the patch would make to the exe as a delta, the exe itself stays as it is
+    content = read_content(game_path)
+    check_crc(calculated_crc, content)
+    rules = get_patch_rules(calculated_crc, width, height, laa_true, laa_false)
+    metadata = get_delta_metadata(calculated_crc, width, height, rules)
+    if calculated_crc in copy_protected_crcs:
+        metadata["disk_check"] = False
+    edits, _ = plan_edits(content, rules, find_rule_matches(content, rules, calculated_crc))
+    delta = make_delta(content, edits, json.dumps(metadata))
+    with open(delta_path, 'wb') as file:
+        file.write(delta)
+    return delta
+
+def get_backup_store_dir():
+    # Original exes are kept here once per CRC, whatever the number of installs
+    if os.environ.get("TYCOON_PATCH_STORE"):
+        return os.environ["TYCOON_PATCH_STORE"]
+    if os.name == 'nt' and os.environ.get("LOCALAPPDATA"):
+        return os.path.join(os.environ["LOCALAPPDATA"], "tycoon_patch", "backups")
+    data_home = os.environ.get("XDG_DATA_HOME") or os.path.join(os.path.expanduser("~"), ".local", "share")
+    return os.path.join(data_home, "tycoon_patch", "backups")
+
+def backup_original(game_path, calculated_crc, extension="bak"):
+    # Saves the exe to the backup store, unless an exe with the same CRC is already there.
+    # The backup next to the exe is a hardlink to the stored one, so it takes no space.
+    # Where it can't be linked (the store on another drive, a filesystem without hardlinks),
+    # it's a copy of the stored one, so there's always a backup to be seen next to the exe
+    store_dir = get_backup_store_dir()
+    os.makedirs(store_dir, exist_ok=True)
+    stored_path = os.path.join(store_dir, f"{calculated_crc}.exe")
+    with timed_phase("backup", bytes=0) as phase:
+        if not os.path.isfile(stored_path):
+            temp_path = f"{stored_path}.{os.getpid()}.tmp"
+            clone_file(game_path, temp_path)
+            os.replace(temp_path, stored_path)
+            phase["bytes"] = os.path.getsize(stored_path)
+
+        backup_path = f"{game_path}.{extension}"
+        if not (os.path.isfile(backup_path) and os.path.samefile(backup_path, stored_path)):
+            if os.path.lexists(backup_path):
+                os.remove(backup_path)
+            try:
+                os.link(stored_path, backup_path)
+            except OSError:
+                temp_path = f"{backup_path}.{os.getpid()}.tmp"
+                clone_file(stored_path, temp_path)
+                os.replace(temp_path, backup_path)
+                phase["bytes"] += os.path.getsize(backup_path)
+    return stored_path
+
+def load_installs():
+    # Which original in the backup store belongs to which exe
+    try:
+        with open(os.path.join(get_backup_store_dir(), "installs.json")) as file:
+            return json.load(file)
+    except (OSError, ValueError):
+        return {}
+
+def remember_installs(new_installs):
+    installs = load_installs()
+    installs.update((os.path.abspath(game_path), crc) for game_path, crc in new_installs.items())
+    os.makedirs(get_backup_store_dir(), exist_ok=True)
+    installs_path = os.path.join(get_backup_store_dir(), "installs.json")
+    temp_path = f"{installs_path}.{os.getpid()}.tmp"
+    with open(temp_path, 'w') as file:
+        json.dump(installs, file, indent=1)
+    os.replace(temp_path, installs_path)
+
+def find_backup(game_path):
+    calculated_crc = load_installs().get(os.path.abspath(game_path))
+    if calculated_crc is not None:
+        stored_path = os.path.join(get_backup_store_dir(), f"{calculated_crc}.exe")
+        if os.path.isfile(stored_path):
+            return stored_path
+    # Backups made before the backup store
     if os.path.isfile(f"{game_path}.bak"):
+        return f"{game_path}.bak"
+    return None
+
+def build_variants(game_path, calculated_crc, resolutions, out_dir, laa_true=False, laa_false=False,
+                   delta_format=False):
+    # Builds patched exes (or deltas) for several resolutions at once, with the disk check removed
+    # for an exe that has one. The exe itself is left as it is.
+    # The exe is read and searched once, each resolution only needs its replacement bytes worked out
+    content = read_content(game_path)
+    check_crc(calculated_crc, content)
+    exe_name = os.path.basename(game_path)
+
+    rule_sets = []
+    with contextlib.redirect_stdout(io.StringIO()):
+        for width, height in resolutions:
+            rule_sets.append(get_patch_rules(calculated_crc, width, height, laa_true, laa_false))
+    matches = find_rule_matches(content, [rule for rules in rule_sets for rule in rules], calculated_crc)
+
+    built = []
+    for (width, height), rules in zip(resolutions, rule_sets):
+        edits, _ = plan_edits(content, rules, matches)
+        if delta_format:
+            out_path = os.path.join(out_dir, f"{os.path.splitext(exe_name)[0]}_{width}x{height}.bps")
+            metadata = get_delta_metadata(calculated_crc, width, height, rules)
+            if calculated_crc in copy_protected_crcs:
+                metadata["disk_check"] = False
+            os.makedirs(out_dir, exist_ok=True)
+            with open(out_path, 'wb') as file:
+                file.write(make_delta(content, edits, json.dumps(metadata)))
+        else:
+            out_path = os.path.join(out_dir, f"{width}x{height}", exe_name)
+            os.makedirs(os.path.dirname(out_path), exist_ok=True)
+            # Edits are written into the same buffer and undone afterwards, instead of copying it
+            originals = [(offset, bytes(content[offset:offset + len(data)])) for offset, data in edits]
+            apply_edits(content, edits)
+            with open(out_path, 'wb') as file:
+                file.write(content)
+            apply_edits(content, reversed(originals))
+        built.append(out_path)
+    return built
+
+def restore_backup(game_path):
+    # Returns whether the exe was restored.
+    # An interrupted patch is finished first, so the exe matches its undo journal
+    finish_interrupted_patch(game_path)
+    backup_path = find_backup(game_path)
+    if backup_path or read_undo_journal(game_path):
         directory = os.path.dirname(game_path)
         if directory:
             settings_path = f"{directory}/settings.dat"
@@ -141,392 +1667,617 @@ def restore_backup():
             os.remove(settings_path)
 
         print(f"Restoring backup")
-        shutil.copy(f"{game_path}.bak", game_path)
+        # Usually only the patched bytes have to be written back
+        if undo_patch(game_path):
+            return True
+        save_undo_journal(game_path, None)
+        if backup_path:
+            # A copy of its own, so patching the exe again won't touch the stored original
+            with timed_phase("restore", bytes=os.path.getsize(backup_path)):
+                clone_over(backup_path, game_path)
+            return True
+        print(f"No backup is found")
     else:
         print(f"No backup is found")
+    return False
+
+def find_game_exes(roots):
+    # Every exe in the directory trees, the games are told apart by CRC later
+    exe_paths = []
+    for root in roots:
+        for directory, _, file_names in os.walk(root):
+            for file_name in file_names:
+                if file_name.lower().endswith('.exe'):
+                    exe_paths.append(os.path.join(directory, file_name))
+    return sorted(exe_paths)
+
+def patch_fleet_file(game_path, width, height, laa_true=False, laa_false=False, in_place=False,
+                     calculated_crc=None, timings=False, strict=False, stream=False, remove_disk_check=False):
+    # Patches one exe of the fleet, returns its report.
+    # Errors are reported instead of raised, so one broken install doesn't stop the others
+    global phase_log
+    phase_log = [] if timings else None
+    started = time.perf_counter()
+    report = {
+        "path": game_path,
+        "status": "patched",
+        "game": None,
+        "crc": None,
+        "resolution": f"{width}x{height}",
+        "rules_applied": 0,
+        "audit": [],
+        "duration": 0,
+        "error": None
+    }
+    try:
+        # Messages of the single exe mode are of no use here
+        with contextlib.redirect_stdout(io.StringIO()):
+            # An interrupted patch is finished first, then its resolution is changed like any patched exe
+            resumed = finish_interrupted_patch(game_path)
+            journal = read_undo_journal(game_path)
+            identity = None
+            if journal is None and not resumed:
+                if calculated_crc is None:
+                    calculated_crc = calculate_crc(game_path)
+                identity = get_crc_identity(None, calculated_crc)
+                report.update(game=identity["game"], crc=calculated_crc)
+
+            if resumed and journal is None:
+                report.update(status="resumed", resolution=None)
+            elif journal is None and calculated_crc not in known_crcs and calculated_crc not in copy_protected_crcs:
+                report["status"] = "unknown"
+            elif journal is None and calculated_crc in copy_protected_crcs and not remove_disk_check:
+                report["status"] = "skipped"
+                report["error"] = "Disk check has to be removed, run the patch with --yes to do that"
+            else:
+                # An exe with an undo journal is repatched, the others get their original backed up first
+                laa = False if laa_false else (True if laa_true else None)
+                patch_plan = plan(game_path, (width, height), laa, identity)
+                report.update(game=patch_plan["game"], crc=patch_plan["crc"], audit=patch_plan["audit"])
+                result = apply(patch_plan, in_place, strict=strict, stream=stream, remember=False)
+                report.update(status=result["status"], rules_applied=result["rules_applied"])
+    except Exception as error:
+        report["status"] = "failed"
+        report["error"] = f"{type(error).__name__}: {error}"
+
+    report["duration"] = round(time.perf_counter() - started, 3)
+    if timings:
+        report["phases"] = phase_log
+    return report
+
+def patch_fleet(roots, width, height, laa_true=False, laa_false=False, in_place=False, workers=None,
+                use_cache=True, timings=False, strict=False, stream=False, remove_disk_check=False):
+    # Patches all the known games found in the directory trees on a pool of processes
+    exe_paths = find_game_exes(roots)
+    cache = load_id_cache() if use_cache else None
+    reports = []
+    with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = {}
+        stamps = {}
+        for exe_path in exe_paths:
+            calculated_crc = None
+            # Files seen before are sorted out here, so the workers only get the games
+            if cache is not None and not os.path.isfile(f"{exe_path}.journal") \
+                    and not os.path.isfile(get_undo_journal_path(exe_path)):
+                try:
+                    stamps[exe_path] = get_file_stamp(exe_path)
+                except OSError:
+                    pass
+                else:
+                    calculated_crc = cached_crc(cache, exe_path, stamps[exe_path])
+                    if calculated_crc is None and size_rules_out(cache, stamps[exe_path][0]):
+                        continue
+                    if calculated_crc is not None and calculated_crc not in known_crcs \
+                            and calculated_crc not in copy_protected_crcs:
+                        continue
+
+            future = executor.submit(patch_fleet_file, exe_path, width, height, laa_true, laa_false, in_place,
+                                     calculated_crc, timings, strict, stream, remove_disk_check)
+            futures[future] = exe_path
+
+        for future in concurrent.futures.as_completed(futures):
+            try:
+                report = future.result()
+            except Exception as error:
+                # The worker itself has died
+                report = {
+                    "path": futures[future],
+                    "status": "failed",
+                    "error": f"{type(error).__name__}: {error}"
+                }
+            # Files left as they were are remembered for the next run,
+            # for the patched ones only the size of the original exe is kept
+            stamp = stamps.get(futures[future])
+            if cache is not None and stamp and report.get("crc") is not None:
+                if report["status"] in ("unknown", "skipped"):
+                    remember_crc(cache, futures[future], stamp, report["crc"])
+                elif get_game_name(report["crc"]):
+                    cache["sizes"][str(report["crc"])] = stamp[0]
+            if report["status"] != "unknown":
+                reports.append(report)
+
+    if cache is not None:
+        save_id_cache(cache)
+    # Which stored original belongs to which exe, for restoring them later
+    remember_installs({report["path"]: report["crc"] for report in reports if report["status"] == "patched"})
+    reports.sort(key=lambda report: report["path"])
+    return {"scanned": len(exe_paths), "files": reports}
+
+# API: the same patching without the command line, for patching many exes in one process.
+# Exes are given by their path or as bytes, results are returned as dicts and nothing is printed
+def is_path(source):
+    return isinstance(source, (str, os.PathLike))
+
+def identify(source, use_cache=True):
+    # Tells which game the exe is of and what was done to it, see identify_exe()
+    if is_path(source):
+        cache = load_id_cache() if use_cache else None
+        identity = identify_exe(os.fspath(source), cache)
+        if cache is not None:
+            save_id_cache(cache)
+        return identity
+
+    identity, _ = match_fingerprints(io.BytesIO(source), load_tables(get_fingerprints_paths()))
+    if identity is not None and identity["state"] in ("pristine", "patched"):
+        return identity
+    return get_crc_identity(identity, zlib.crc32(source))
+
+def plan(source, resolution=None, laa=None, identity=None):
+    # Works out the edits that patch the exe, without changing it.
+    # Resolution is "WxH" or (width, height), the screen resolution by default.
+    # LAA fix is applied when laa is True, left out when it's False, and chosen by the resolution when None.
+    # The exe of a game with disk check gets the disk check removed as well.
+    # An exe patched before is repatched when its undo journal matches it: the new patch is worked out
+    # on its original bytes, and the edits only change the sites that differ between the two patches.
+    # Raises ValueError if the exe can't be patched
+    journal = read_undo_journal(os.fspath(source)) if is_path(source) else None
+    if journal is not None:
+        calculated_crc = journal["crc"]
+    else:
+        if identity is None:
+            identity = identify(source)
+        calculated_crc = identity["crc"]
+        if identity["state"] == "patched":
+            raise ValueError(f"The exe is already patched to {identity['resolution'] or 'another resolution'}, "
+                             f"restore it first.")
+        if calculated_crc not in known_crcs and calculated_crc not in copy_protected_crcs:
+            raise ValueError(f"The exe is not one of the supported games, its CRC is {calculated_crc}.")
+
+    # Messages of the rules are returned as notes
+    notes = io.StringIO()
+    with contextlib.redirect_stdout(notes):
+        if isinstance(resolution, tuple):
+            width, height = resolution
+        else:
+            width, height = get_res(resolution or False)
+        rules = get_patch_rules(calculated_crc, width, height, laa is True, laa is False)
+
+    with contextlib.ExitStack() as stack:
+        content = source
+        if journal is not None:
+            file = stack.enter_context(open(source, 'rb'))
+            sites = get_original_bytes(file, journal["edits"])
+            content = OriginalContent(file, sites)
+        elif is_path(source):
+            # Only the pages with the patch sites are read
+            content = stack.enter_context(map_content(source))
+        edits, counts = plan_edits(content, rules, find_rule_matches(content, rules, calculated_crc))
+        undo_entries = get_undo_entries(content, edits)
+        entries = undo_entries
+        size = len(content)
+        if journal is not None:
+            entries = get_repatch_entries(FileContent(file), sites, edits)
+    return {
+        "source": source,
+        "game": get_game_name(calculated_crc),
+        "crc": calculated_crc,
+        "crc_checked": journal is None and identity.get("crc_checked", False),
+        "resolution": f"{width}x{height}",
+        "repatch": journal is not None,
+        "laa": laa_rule in rules,
+        "removes_disk_check": journal is None and calculated_crc in copy_protected_crcs,
+        "rules": [rule._asdict() for rule in rules],
+        "counts": counts,
+        "audit": audit_counts(rules, counts, calculated_crc),
+        "size": size,
+        "edits": entries,
+        "undo_edits": undo_entries,
+        "notes": notes.getvalue().splitlines()
+    }
 
-# Arguments
-arguments = sys.argv
-game_path = False
-res_arg = False
-laa_true = False
-laa_false = False
-restore_arg = False
-games_arg = False
-help_arg = False
-for arg in arguments:
-    if arg.endswith('.exe'):
-        game_path = arg
-    elif re.match(r'\d+x\d+', arg):
-        res_arg = arg
-    elif arg == "--lla=true":
-        laa_true = True
-    elif arg == "--lla=false":
-        laa_false = True
-    elif arg == "--restore" or arg == "-r":
-        restore_arg = True
-    elif arg == "--games" or arg == "-g":
-        games_arg = True
-    elif arg == "--help" or arg == "-h":
-        help_arg = True
-
-if not game_path:
-    # When adding new game, don't forget to update array here
-    known_exes = [
-        "SkiGame.exe",
-        "CruiseShipTycoon.exe",
-        "Skate3.exe",
-        "MC.exe",
-        "SC.exe",
-        "SchoolTycoon.exe",
-        "SRE.exe",
-        "Mall3Game.exe",
-        "Wildfire.exe"
-    ]
-
-    # Check if each file exists
-    for known_exe in known_exes:
-        if os.path.isfile(known_exe):
-            game_path = known_exe
-            break
-
-if not os.path.isfile(game_path) or not game_path:
-    print("Game is not found!")
-
-if restore_arg:
-    restore_backup()
-elif games_arg:
-    # When adding new game, don't forget to update list here
-    games_msg = """
-List of supported games:
-    - Cruise Ship Tycoon (2003), replaces 1280x960 resolution
-    - Medieval Conquest (2004), replaces 1280x960 resolution
-    - Outdoor Life: Sportsman's Challenge (2004), replaces 1280x960 resolution
-    - School Tycoon (2004), replaces 1280x960 resolution
-    - Ski Resort Extreme (2004), replaces 1280x960 resolution
-    - Mall Tycoon 3 (2005), replaces 1280x960 resolution
-    - Wildfire (2005), replaces 1280x960 resolution
-        """
-    print(games_msg)
-elif help_arg:
-    help_msg = """
+def apply(patch_plan, in_place=False, backup=True, strict=False, stream=False, remember=True):
+    # Makes the edits of the plan. An exe given by its path is written the same way as by the command line,
+    # after its original is put to the backup store, in blocks with stream;
+    # without remember, the caller records the exe in installs.json itself, from one process (see patch_fleet);
+    # a repatch is written in place unless stream is given, its original is in the backup store already;
+    # an exe given as bytes is returned patched as "content".
+    # Raises ValueError if the exe was changed since the plan was made or its CRC is not the one of the plan,
+    # or with strict if a rule had a wrong number of matches (see "audit" of the plan)
+    if strict and patch_plan["audit"]:
+        rules = [Rule(**rule) for rule in patch_plan["rules"]]
+        check_counts(rules, patch_plan["counts"], patch_plan["crc"], strict)
+    source = patch_plan["source"]
+    calculated_crc = patch_plan["crc"]
+    edits = [(offset, bytes.fromhex(data)) for offset, _, data in patch_plan["edits"]]
+    result = {
+        "path": os.fspath(source) if is_path(source) else None,
+        "status": "repatched" if patch_plan["repatch"] else "patched",
+        "game": patch_plan["game"],
+        "crc": calculated_crc,
+        "resolution": patch_plan["resolution"],
+        "rules_applied": sum(1 for count in patch_plan["counts"] if count),
+        "bytes_written": sum(len(data) for _, data in edits)
+    }
+    undo = {"crc": calculated_crc, "game": patch_plan["game"], "resolution": patch_plan["resolution"],
+            "size": patch_plan["size"], "edits": patch_plan["undo_edits"]}
+
+    if not is_path(source):
+        content = bytearray(source)
+        check_crc(calculated_crc, content)
+        check_plan(content, patch_plan)
+        apply_edits(content, edits)
+        result["content"] = content
+        return result
+
+    game_path = os.fspath(source)
+    if patch_plan["repatch"]:
+        in_place = in_place or not stream
+    else:
+        # A changed exe must not end up in the backup store as the original of its CRC
+        with open(game_path, 'rb') as file:
+            check_plan(FileContent(file), patch_plan)
+        if not patch_plan["crc_checked"]:
+            check_crc(calculated_crc, file_path=game_path)
+        if backup:
+            backup_original(game_path, calculated_crc, "bak" if calculated_crc in known_crcs else "orig")
+            if remember:
+                remember_installs({game_path: calculated_crc})
+    with edit_file(game_path, in_place, stream) as (content, write):
+        check_plan(content, patch_plan)
+        write(edits, undo)
+    return result
+
+def check_plan(content, patch_plan):
+    # The bytes each edit replaces have to be as they were when the plan was made
+    edits = []
+    for offset, original, data in patch_plan["edits"]:
+        original = bytes.fromhex(original)
+        if offset + len(original) > len(content) or \
+                current_bytes(content, offset, offset + len(original), edits) != original:
+            raise ValueError("The exe was changed since the patch was planned.")
+        edits.append((offset, bytes.fromhex(data)))
+
+def print_audit(problems):
+    for problem in problems:
+        print(f"Warning: {problem['search']} matched {problem['matches']} times, "
+              f"{problem['expected']} expected")
+
+def print_timings(phases, seconds):
+    print(f"{'Phase':<12} {'Seconds':>10} {'Bytes':>12} {'Matches':>8}  Search")
+    for phase in phases:
+        print(f"{phase['phase']:<12} {phase['seconds']:>10.6f} {phase.get('bytes', ''):>12}"
+              f" {phase.get('matches', ''):>8}  {phase.get('search', '')}")
+    print(f"{'total':<12} {seconds:>10.6f}")
+
+def print_resolutions():
+    try:
+        modes = get_display_modes(get_display_name())
+    except (OSError, AttributeError) as error:
+        print(f"Display modes can't be read: {error}")
+        return
+    print("\nResolutions of your display:")
+    for width, height in modes:
+        tested = " (tested)" if (width, height) in tested_resolutions.values() else ""
+        print(f"    - {width}x{height}{tested}")
+
+help_msg = """
 This is a patch for several tycoon games from the early 2000s.
 It replaces the default letterbox resolution (4:3) with a widescreen one (16:9, 16:10). 
 If necessary, LAA fix (4GB patch) and HUD fixes are also applied to accommodate new resolutions.
 Usually it's enough to run the patch from the game folder, it should detect your screen resolution automatically.
-On Linux, you will need to have pyautogui pip package to detect your screen resolution.
+On Linux, the screen resolution is read from the X server (libX11), or it can be set in TYCOON_PATCH_RESOLUTION.
 If you need to define the game path, resolution, and so on, use the following arguments:
 
     "path\\to\\the\\game.exe" defines path to the game exe
     (width)x(height) sets custom resolution (for example, 1920x1080)
     --lla=true enables LAA fix (4GB patch) that improves stability, it's on if resolution >= 2560x1440
     --lla=false disables LAA fix even if resolution >= 2560x1440
+    --in-place patches the exe through a memory map, writing only the changed bytes
+    --stream reads and writes the exe in blocks of 1 MB, so the memory used doesn't depend on the size of the exe
     --restore (-r) restores the game exe from the backup and resets user settings, using the backup created during patching
+    --repatch changes the resolution of an exe that was patched before, rewriting only the patched bytes,
+        it's done without this argument as well when the exe has an undo journal
+    --fleet patches all the games found in the given folders (current folder by default) and prints a JSON report
+    --workers=(number) sets the number of processes used by --fleet, number of CPUs by default
+    --report=(path) saves the --fleet report to a file instead of printing it
+    --export-delta=(path) saves the changes of the patch as a BPS delta file instead of patching the exe
+    --apply-delta=(path) patches the exe with a delta file made by --export-delta
+    --build=(width)x(height),(width)x(height),... saves patched copies of the exe for each of the resolutions,
+        leaving the exe as it is
+    --out=(path) sets the folder for --build, "builds" next to the exe by default
+    --format=bps makes --build save delta files instead of patched exes
+    --build-tables saves offsets of the patched bytes of the given exe, or of the games in the given folders,
+        to patch_tables.json next to the patch, so the exe doesn't have to be searched when patching
+    --no-cache doesn't use the cache of exe CRCs, so every exe is read again
+    --timings prints how long each phase of the patching took, with the bytes it touched
+        and the number of matches of each rule
+    --json prints what was done as JSON, with the timings of the phases, other messages go to stderr
+    --strict stops the patching before anything is written if a rule doesn't match as many times as expected,
+        without it a warning is printed
+    --identify tells which game the exe is of, and whether it's original, patched (to which resolution)
+        or with disk check removed, without patching it
+    --yes (-y) removes the disk check of the games that have one without asking, for --fleet as well
     --games (-g) prints the list of supported games
+    --resolutions prints the resolutions your display supports, the tested ones first
     --help (-h) prints this help message
-        """
-    print(help_msg)
-else:
-    # When adding new game, don't forget to update this section
-    # Checking CRC of exe file
-    calculated_crc = calculate_crc(game_path)
-
-    known_crcs = {
-        1447773004: "ski",
-        2552423476: "medieval",
-        1142252342: "cruise", # old version
-        3759243516: "cruise", # latest version
-        2787501884: "skateboard2004",
-        554985168: "challenge",
-        490347772: "school",
-        3371513462: "extreme",
-        495043694: "mall3",
-        667719983: "wildfire"
-    }
-
-    copy_protected_crcs = {
-        3047680879: "ski",
-        695746026: "challenge",
-        3801619499: "extreme",
-        1814945630: "mall3",
-        1646831127: "wildfire"
-    }
-
-    old_crcs = {
-        3298446386: "ski",
-        1756356010: "medieval",
-        4056039368: "school",
-        2176966923: "extreme"
-    }
+    """
+
+# Arguments that switch an option on, and the ones that give it a value
+flag_arguments = {
+    "--lla=true": "laa_true", "--lla=false": "laa_false", "--restore": "restore", "-r": "restore",
+    "--in-place": "in_place", "--repatch": "repatch", "--identify": "identify", "--fleet": "fleet",
+    "--build-tables": "build_tables", "--timings": "timings", "--json": "json", "--strict": "strict",
+    "--stream": "stream", "--yes": "yes", "-y": "yes", "--games": "games", "-g": "games",
+    "--resolutions": "resolutions", "--help": "help", "-h": "help"
+}
+value_arguments = {
+    "--workers": "workers", "--report": "report", "--build": "build", "--out": "out", "--format": "format",
+    "--export-delta": "export_delta", "--apply-delta": "apply_delta"
+}
+
+def parse_arguments(arguments):
+    options = {option: False for option in list(flag_arguments.values()) + list(value_arguments.values())}
+    options.update(game_path=False, res=False, roots=[], workers=None, format="exe", cache=True)
+    for arg in arguments[1:]:
+        name, _, value = arg.partition('=')
+        if arg.endswith('.exe'):
+            options["game_path"] = arg
+        elif re.match(r'\d+x\d+', arg):
+            options["res"] = arg
+        elif arg in flag_arguments:
+            options[flag_arguments[arg]] = True
+        elif value and name in value_arguments:
+            options[value_arguments[name]] = int(value) if name == "--workers" else value
+        elif arg == "--no-cache":
+            options["cache"] = False
+        elif os.path.isdir(arg):
+            options["roots"].append(arg)
+    return options
+
+def get_laa_option(options):
+    return False if options["laa_false"] else (True if options["laa_true"] else None)
+
+def fleet_command(options):
+    # The report goes to stdout, so everything else is printed to stderr
+    with contextlib.redirect_stdout(sys.stderr):
+        width, height = get_res(options["res"])
+        fleet_report = patch_fleet(options["roots"] or ["."], width, height,
+                                   options["laa_true"], options["laa_false"], options["in_place"],
+                                   options["workers"], options["cache"], options["timings"], options["strict"],
+                                   options["stream"], options["yes"])
+        patched = [report for report in fleet_report["files"]
+                   if report["status"] in ("patched", "repatched", "resumed")]
+        print(f"Patched {len(patched)}"
+              f" of {len(fleet_report['files'])} games found in {fleet_report['scanned']} exe files")
+
+    if options["report"]:
+        with open(options["report"], 'w') as file:
+            json.dump(fleet_report, file, indent=2)
+    else:
+        print(json.dumps(fleet_report, indent=2))
+
+def build_tables_command(options):
+    exe_paths = [options["game_path"]] if options["game_path"] else find_game_exes(options["roots"] or ["."])
+    for exe_path in build_patch_tables(exe_paths, get_patch_tables_paths()[0]):
+        print(f"Patch table is made for {exe_path}")
+
+def print_games():
+    games_msg = "\nList of supported games:\n"
+    for game in game_index.values():
+        if game["title"]:
+            games_msg += f"    - {game['title']}, replaces 1280x960 resolution\n"
+    print(games_msg)
 
-    if calculated_crc in known_crcs:
-        # Identifying the game
-        game_name = known_crcs[calculated_crc]
-        # Create a backup of the original file
-        print(f"Making a backup")
-        shutil.copy(game_path, f"{game_path}.bak")
-
-        print("Patching the game")
-        with open(game_path, 'rb') as game:
-            game_content = game.read()
-
-        # Getting the resolution
-        width, height = get_res(res_arg)
-
-        # Applying LAA fix (4GB patch) if needed
-        # So far it is the same line for all the games
-        if not laa_false:
-            if (width >= 2560 or height >= 1440) or laa_true:
-                print("LAA fix for better stability")
-                game_content = replace_bytes(game_content, "0F010B01",
-                                             f"2F010B01")
+# Commands for one exe, they add what was done to the record
+def apply_delta_command(game_path, options, record):
+    try:
+        metadata = apply_delta_file(game_path, options["apply_delta"])
+    except ValueError as error:
+        print(error)
+        record["status"] = "failed"
+        return
+    record.update(game=metadata.get("game"), resolution=metadata.get("resolution"), status="patched")
+    if metadata.get("resolution"):
+        print(f"Patched {metadata.get('game')} to {metadata['resolution']} from the delta")
+    else:
+        print("File has been patched from the delta")
+
+def identify_command(game_path, options, record):
+    cache = load_id_cache() if options["cache"] else None
+    identity = identify_exe(game_path, cache)
+    if cache is not None:
+        save_id_cache(cache)
+    record.update(crc=identity["crc"], game=identity["game"], resolution=identity["resolution"],
+                  status=identity["state"], laa=identity["laa"])
+    if identity["game"] is None:
+        print("This exe is not one of the supported games")
+    else:
+        print(f"Game: {identity['game']}")
+        print(f"State: {identity['state']}")
+        if identity["state"] == "patched":
+            print(f"Resolution: {identity['resolution'] or 'unknown'}")
+            print(f"LAA fix: {'applied' if identity['laa'] else 'not applied'}")
+
+def repatch_command(game_path, options, record):
+    # The exe was patched before, so only the patched sites are changed
+    # instead of identifying the exe and patching it all over again
+    journal = read_undo_journal(game_path)
+    if journal is None:
+        print("No undo journal matching the exe is found, the exe has to be patched first")
+        return
+    print(f"This exe is already patched to {journal['resolution']}, changing its resolution")
+    patch_plan = plan(game_path, get_res(options["res"]), get_laa_option(options))
+    record.update(game=patch_plan["game"], crc=patch_plan["crc"])
+    if apply_command(patch_plan, options, record):
+        print_patched(patch_plan["game"])
+
+def apply_command(patch_plan, options, record):
+    # Applies the plan to the exe, printing what was done
+    for note in patch_plan["notes"]:
+        print(note)
+    print_audit(patch_plan["audit"])
+    try:
+        apply(patch_plan, options["in_place"], strict=options["strict"], stream=options["stream"])
+    except ValueError as error:
+        print(error)
+        print("The exe is left as it was")
+        record["status"] = "failed"
+        return False
+    record.update(resolution=patch_plan["resolution"], status="patched")
+    return True
+
+def print_patched(game_name):
+    print("File has been patched successfully")
+    if game_name != "ski":
+        print("Don't forget to set game resolution to 1280x960 in options!")
+
+def patch_command(game_path, options, record):
+    # Checking CRC of exe file
+    cache = load_id_cache() if options["cache"] else None
+    identity = identify_exe(game_path, cache)
+    calculated_crc = identity["crc"]
+    if cache is not None:
+        save_id_cache(cache)
+    record.update(crc=calculated_crc, game=identity["game"], status="unknown")
+
+    if identity["state"] == "patched":
+        print(f"This exe is already patched to {identity['resolution'] or 'another resolution'}. "
+              f"Restore it with -r and run the patch again.")
+        record["resolution"] = identity["resolution"]
+    elif calculated_crc is None:
+        print("Wrong file! It doesn't match any of the supported games.")
+    elif calculated_crc in known_crcs or calculated_crc in copy_protected_crcs:
+        if options["build"]:
+            build_command(game_path, calculated_crc, options, record)
+        elif options["export_delta"]:
+            width, height = get_res(options["res"])
+            delta = export_delta(game_path, options["export_delta"], calculated_crc, width, height,
+                                 options["laa_true"], options["laa_false"])
+            print(f"Delta of {len(delta)} bytes is saved to \"{options['export_delta']}\"")
+            record["status"] = "exported"
         else:
-            if (width >= 2560 or height >= 1440):
-                print("LAA fix is disabled, things may be unstable")
-
-        width_le = struct.pack('<I', width).hex()
-        height_le = struct.pack('<I', height).hex()
-
-        # Perform actions based on the identified game
-        if game_name == "ski":
-            # This game requires Windows XP compatibility mode on Windows, otherwise it glitches
-            # Have no idea how to that one yet
-            pass
-        elif game_name == "cruise":
-            # Notice if game version is not the latest
-            if calculated_crc == 1142252342:
-                print(" FYI: this is not the latest version of the game")
-                print(" Not that it matters, this patch will work as is.")
-                print(" But if you wish, look for Update 3 of the game,")
-                print(" and patch again after updating.")
-
-            # Main Menu resolution
-            menu_height = height
-            menu_width = (4 * menu_height) / 3
-            menu_width = round(menu_width)
-
-            if (menu_width == 1067 and menu_height == 800) or \
-                    (menu_width == 1200 and menu_height == 900):
-                # These 4:3 resolutions make the game render in 640x480,
-                # using 1024x768
-                menu_width = 1024
-                menu_height = 768
-            elif (menu_width == 960 and menu_height == 720):
-                # Same as above
-                # using 1920x1440
-                menu_width = 800
-                menu_height = 600
-            elif (menu_width == 2880 and menu_height == 2160):
-                # Same as above
-                # using 1920x1440
-                menu_width = 1920
-                menu_height = 1440
-
-            menu_width_le = struct.pack('<I', menu_width).hex()
-            menu_height_le = struct.pack('<I', menu_height).hex()
-
-            print(f"Changing menu resolution to {menu_width}x{menu_height}")
-            if calculated_crc == 1142252342:
-                game_content = replace_bytes(game_content, "20030000C744243858020000",
-                                             f"{menu_width_le}C7442438{menu_height_le}")
-            elif calculated_crc == 3759243516:
-                game_content = replace_bytes(game_content, "20030000C744243458020000",
-                                             f"{menu_width_le}C7442434{menu_height_le}")
-
-            # In-game resolution
-            if calculated_crc == 1142252342:
-                game_content = replace_bytes(game_content, "00050000E8DCF80100C74030C0030000",
-                                            f"{width_le}E8DCF80100C74030{height_le}")
-            elif calculated_crc == 3759243516:
-                game_content = replace_bytes(game_content, "00050000E80AE50100C74030C0030000",
-                                            f"{width_le}E80AE50100C74030{height_le}")
-
-            # HUD fixes
-            game_content = replace_bytes(game_content, "3d000500007505",
-                                         f"3d{width_le}7505")
-
-            fix_height = height - 600
-
-            # Convert fix value to little-endian hexadecimal value
-            fix_h_le = struct.pack('<I', fix_height).hex()
-
-            game_content = replace_bytes(game_content, "BD68010000C7", f"BD{fix_h_le}C7")
-            game_content = replace_bytes(game_content, "000500007509BD68010000", f"{width_le}7509BD{fix_h_le}")
-        elif game_name == "challenge" or game_name == "skateboard2004":
-            game_content = replace_bytes(game_content, "c7402c00050000", f"c7402c{width_le}")
-            game_content = replace_bytes(game_content, "c74030c0030000", f"c74030{height_le}")
-
-            # HUD fixes
-            game_content = replace_bytes(game_content, "740b3d00050000", f"740b3d{width_le}")
-            if game_name == "skateboard2004":
-                # Remove black bars
-                # Move buttons below to the left
-                # Fix cursor
-                pass
-            else:
-                game_content = replace_bytes(game_content, "741a3d00050000", f"741a3d{width_le}")
-
-                # This moves the options window in-game to the upper left corner, so that it no longer mutes the game
-                game_content = replace_bytes(game_content, "2BC2D1F889442410E8", "2BC231C089442410E8")
-                game_content = replace_bytes(game_content, "8BC5992BC28BE8D1FD", "8BC5992BC28BE831ED")
-        elif game_name == "school":
-            # In-game resolution
-            game_content = replace_bytes(game_content, "402C00050000",
-                                         f"402C{width_le}")
-            game_content = replace_bytes(game_content, "4030C0030000",
-                                         f"4030{height_le}")
-
-            # HUD fixes
-            if width != 1280:
-                # Fixing position of the buttons in the lower side of the screen
-                # by replacing E0FCFFFF (-800) with negative value of the current width
-                negative_width = -width
-                negative_width_le = struct.pack('<i', negative_width).hex()
-                game_content = replace_bytes(game_content, "8D81E0FCFFFF",
-                                             f"8D81{negative_width_le}")
-
-                # Prevents game crashes
-                game_content = replace_bytes(game_content, "741A3D00050000",
-                                             f"741A3D{width_le}")
-                game_content = replace_bytes(game_content, "eb093d00050000",
-                                             f"eb093d{width_le}")
-                game_content = replace_bytes(game_content, "740B3D00050000",
-                                             f"740B3D{width_le}")
-                game_content = replace_bytes(game_content, "e8896502003d00050000",
-                                             f"e8896502003d{width_le}")
-                game_content = replace_bytes(game_content, "74243d00050000",
-                                             f"74243d{width_le}")
-                game_content = replace_bytes(game_content, "e8dece00003d00050000",
-                                             f"e8dece00003d{width_le}")
-                game_content = replace_bytes(game_content, "e893cb00003d00050000",
-                                             f"e893cb00003d{width_le}")
-                game_content = replace_bytes(game_content, "e851c900003d00050000",
-                                             f"e851c900003d{width_le}")
-
-            # Fixing position of objectives button and history button
-            # The position is relative to the respective window that's opened after button is pressed,
-            # so we calculate needed value based on that
-            if width == 1280:
-                # Buttons are centered, so their position is a bit different
-                objective_x = 712 - ((width / 2) - 148)
-                history_x = 770 - ((width / 2) - 175)
-            else:
-                objective_x = 472 - ((width / 2) - 148)
-                history_x = 530 - ((width / 2) - 175)
-
-            history_y = (height - 33) - ((height / 2) - 212)
-            objective_y = (height - 33) - ((height / 2) - 113)
-            objective_y_instant = objective_y - 25
-
-            if objective_x < 0:
-                o_x_le = struct.pack('<i', int(objective_x)).hex()
-            else:
-                o_x_le = struct.pack('<I', int(objective_x)).hex()
-            o_y_le = struct.pack('<I', int(objective_y)).hex()
-            o_y_i_le = struct.pack('<I', int(objective_y_instant)).hex()
-
-            if history_x < 0:
-                h_x_le = struct.pack('<i', int(history_x)).hex()
-            else:
-                h_x_le = struct.pack('<I', int(history_x)).hex()
-            h_y_le = struct.pack('<I', int(history_y)).hex()
-
-            game_content = replace_bytes(game_content, "740B81C730020000",
-                                         f"740B81C7{o_y_le}")
-            game_content = replace_bytes(game_content, "81c717020000",
-                                         f"81c7{o_y_i_le}")
-            game_content = replace_bytes(game_content, "526A4F81C6DC000000",
-                                         f"526A4F81C6{o_x_le}")
-
-            game_content = replace_bytes(game_content, "68930200006831010000",
-                                         f"68{h_y_le}68{h_x_le}")
-
-            # Save game window
-            if width == 1280 and height == 720:
-                game_content = replace_bytes(game_content, "81FB00040000",
-                                             f"81FB{width_le}")
-                game_content = replace_bytes(game_content, "81FB00050000",
-                                             f"81FB00000000")
-
-                save_x = (width / 2)
-                save_y = (height / 2)
-            else:
-                game_content = replace_bytes(game_content, "81FB00050000",
-                                             f"81FB{width_le}")
-
-                save_x = (width / 2) - 240
-                save_y = (height / 2) - 180
-
-            save_x_le = struct.pack('<I', int(save_x)).hex()
-            save_y_le = struct.pack('<I', int(save_y)).hex()
-
-            game_content = replace_bytes(game_content, "2D90010000",
-                                         f"2D{save_x_le}")
-            game_content = replace_bytes(game_content, "2D2C010000",
-                                         f"2D{save_y_le}")
-
-            # Removes displaced frame in a classroom view
-            game_content = replace_bytes(game_content, "313238307839363000", f"000000000000000000")
-        elif game_name == "extreme" or game_name == "wildfire" or game_name == "medieval":
-            # In-game resolution
-            game_content = replace_bytes(game_content, "c7402c00050000",
-                                         f"c7402c{width_le}")
-            game_content = replace_bytes(game_content, "c74030c0030000",
-                                         f"c74030{height_le}")
-
-            # HUD fixes
-            game_content = replace_bytes(game_content, "740B3D00050000",
-                                         f"740B3D{width_le}")
-        elif game_name == "mall3":
-            # Resolution
-            game_content = replace_bytes(game_content, "c7402800050000", f"c74028{width_le}")
-            game_content = replace_bytes(game_content, "c7402cc0030000", f"c7402c{height_le}")
-
-            # HUD fixes
-            game_content = replace_bytes(game_content, "740e3d00050000", f"740e3d{width_le}")
-            game_content = replace_bytes(game_content, "0f84e70000003d00050000", f"0f84e70000003d{width_le}")
-
-        # Save the modified content to a new file
-        with open(game_path, 'wb') as game:
-            game.write(game_content)
-
-        print("File has been patched successfully")
-        if game_name != "ski":
-            print("Don't forget to set game resolution to 1280x960 in options!")
-    elif calculated_crc in copy_protected_crcs:
-        # Identifying the game
-        game_name = copy_protected_crcs[calculated_crc]
-        # Removing copy protection
-        print('This version of the game requires CD to play the game.')
-        print('Disk check will be removed')
-        response = input("Write yes to proceed (yes/no): ").strip().lower()
-        if response == "yes":
-            print("Removing disk check")
-            shutil.copy(game_path, f"{game_path}.orig")
-            print(f"Original executable is saved to \"{game_path}.orig\"")
-            with open(game_path, 'rb') as game:
-                game_content = game.read()
-
-            if game_name == "ski":
-                game_content = replace_bytes(game_content, "74206A15", "EB206A15")
-            elif game_name == "challenge":
-                game_content = replace_bytes(game_content, "E8D8FDFFFF85C07547", "E8D8FDFFFF85C0EB47")
-            elif game_name == "extreme":
-                game_content = replace_bytes(game_content,
-                                             "752D84C08BCF7427A014E06900908D64240084C074198A1980CB200C203AD8750E8A440E014184C0746E",
-                                             "909084C08BCF9090A014E06900908D64240084C090908A1980CB200C203AD890908A440E014184C0EB6E")
-            elif game_name == "wildfire":
-                game_content = replace_bytes(game_content, "0F8518FFFFFFE8", "E919FFFFFFFFE8")
-            elif game_name == "mall3":
-                game_content = replace_bytes(game_content, "8B35B0F26B00EB09", "8B35B0F26B00EB2B")
-
-            with open(game_path, 'wb') as game:
-                game.write(game_content)
-            print("Disk check was removed")
-            print("Re-run this patch to change resolution of the game")
+            patch_game_command(game_path, identity, options, record)
     elif calculated_crc in old_crcs:
         # For Ski Resort Tycoon: https://www.patches-scrolls.de/patch/3781/7/30965
         print('This is an old version of the game!')
         print('Update the game and run the patch again.')
+    elif find_backup(game_path):
+        print(f"Didn't recognize CRC: {calculated_crc}, but there's a backup of this exe. "
+              f"It was probably patched already, restore it with -r and run the patch again.")
     else:
         print(f"Wrong file! Didn't recognize CRC: {calculated_crc}. Maybe this is not the latest version or the patch was already applied.")
+
+def build_command(game_path, calculated_crc, options, record):
+    resolutions = [parse_resolution(res) for res in options["build"].split(',')]
+    if calculated_crc in copy_protected_crcs:
+        print("This version of the game requires CD to play the game, the disk check is removed in the builds")
+    out_dir = options["out"] or os.path.join(os.path.dirname(game_path), "builds")
+    for out_path in build_variants(game_path, calculated_crc, resolutions, out_dir,
+                                   options["laa_true"], options["laa_false"], options["format"] == "bps"):
+        print(f"Saved \"{out_path}\"")
+    record["status"] = "built"
+
+def patch_game_command(game_path, identity, options, record):
+    calculated_crc = identity["crc"]
+    if calculated_crc in copy_protected_crcs:
+        # Removing copy protection, the game is patched in the same pass
+        print('This version of the game requires CD to play the game.')
+        print('Disk check will be removed')
+        if not options["yes"] and input("Write yes to proceed (yes/no): ").strip().lower() != "yes":
+            record["status"] = "skipped"
+            return
+        print("Removing disk check")
+    # The original file is saved to the backup store when the patch is applied
+    print(f"Making a backup")
+    print("Patching the game")
+
+    # Getting the resolution
+    width, height = get_res(options["res"])
+    patch_plan = plan(game_path, (width, height), get_laa_option(options), identity)
+    if apply_command(patch_plan, options, record):
+        if calculated_crc in copy_protected_crcs:
+            if os.path.isfile(f"{game_path}.orig"):
+                print(f"Original executable is saved to \"{game_path}.orig\"")
+            else:
+                print(f"Original executable is saved to \"{get_backup_store_dir()}\"")
+            print("Disk check was removed")
+        print_patched(identity["game"])
+
+def main(arguments):
+    options = parse_arguments(arguments)
+    if options["fleet"]:
+        return fleet_command(options)
+    if options["build_tables"]:
+        return build_tables_command(options)
+
+    global phase_log
+    if options["timings"] or options["json"]:
+        phase_log = []
+    started = time.perf_counter()
+    # What was done, for --json and --timings
+    record = {"path": None, "game": None, "crc": None, "resolution": None, "status": None}
+    output = contextlib.ExitStack()
+    if options["json"]:
+        # The record goes to stdout, so everything else is printed to stderr
+        output.enter_context(contextlib.redirect_stdout(sys.stderr))
+
+    game_path = options["game_path"]
+    if not game_path:
+        # Check if each file exists
+        for known_exe in known_exes:
+            if os.path.isfile(known_exe):
+                game_path = known_exe
+                break
+
+    if not os.path.isfile(game_path) or not game_path:
+        print("Game is not found!")
+    record["path"] = game_path or None
+
+    if options["restore"]:
+        if restore_backup(game_path):
+            record["status"] = "restored"
+    elif options["apply_delta"]:
+        apply_delta_command(game_path, options, record)
+    elif options["games"]:
+        print_games()
+    elif options["resolutions"]:
+        print_resolutions()
+    elif options["help"]:
+        print(help_msg)
+    elif options["identify"]:
+        identify_command(game_path, options, record)
+    elif finish_interrupted_patch(game_path):
+        print("Finished patching that was interrupted last time")
+        print("File has been patched successfully")
+        record["status"] = "resumed"
+    elif options["repatch"] or (read_undo_journal(game_path) and not options["build"] and not options["export_delta"]):
+        repatch_command(game_path, options, record)
+    else:
+        patch_command(game_path, options, record)
+
+    output.close()
+    record["seconds"] = round(time.perf_counter() - started, 6)
+    if phase_log is not None:
+        record["phases"] = phase_log
+    if options["json"]:
+        print(json.dumps(record, indent=2))
+    elif options["timings"]:
+        print_timings(phase_log, record["seconds"])
+
+if __name__ == "__main__":
+    try:
+        main(sys.argv)
+    except ValueError as error:
+        # Such as a resolution that can't be detected, there's nothing to patch without it
+        print(error)
+        sys.exit(1)
@@ -0,0 +1,304 @@
+# tycoon_service.py
+#
+# Local patch service. Worker processes are started once with the rules of all the games ready,
+# then patch, verify and restore jobs for exe paths are sent to it over HTTP,
+# on localhost or on a Unix socket, without starting Python for every exe.
+#
+# Usage: python tycoon_service.py [--port=8765] [--socket=path] [--workers=(number)] [--token=(token)]
+#
+# Requests on localhost need "Authorization: Bearer (token)", the token is saved to service_token
+# in the cache folder of the patch when it's not given. Requests on the Unix socket need none,
+# the permissions of the socket file decide who can send them.
+# Jobs are sent with "Content-Type: application/json", so a web page can't send them from a browser.
+#
+#   POST /jobs       {"action": "patch", "path": "...", "resolution": "1920x1080", "laa": null, "in_place": false,
+#                     "stream": false, "remove_disk_check": false}
+#                    Exes with disk check are skipped unless "remove_disk_check" is true.
+#                    "verify" and "restore" jobs only need the path. A list of jobs can be sent at once.
+#                    Returns the jobs right away, or when they are done if "wait" is true
+#   GET /jobs/(id)   returns the job with its status (queued, running, done or failed) and result
+#   GET /metrics     returns the number of jobs by status and the throughput
+
+import asyncio
+import collections
+import concurrent.futures
+import contextlib
+import io
+import json
+import sys
+import os
+import secrets
+import time
+
+import tycoon_patch
+
+# Finished jobs kept for GET /jobs/(id), the older ones are forgotten
+kept_jobs = 10000
+
+def load_rule_engines():
+    # Runs once in each worker: compiles the search patterns of every game,
+    # grouped by sections the same way as they are scanned
+    with contextlib.redirect_stdout(io.StringIO()):
+        for calculated_crc in list(tycoon_patch.known_crcs) + list(tycoon_patch.copy_protected_crcs):
+            rule_sets = [tycoon_patch.get_patch_rules(calculated_crc, width, height, laa_true=True)
+                         for width, height in tycoon_patch.tested_resolutions.values()]
+            for rules in rule_sets:
+                groups = {}
+                for rule in rules:
+                    groups.setdefault(rule.sections, set()).add(bytes.fromhex(rule.search))
+                for patterns in groups.values():
+                    tycoon_patch.compile_patterns(tuple(sorted(patterns)))
+
+def run_job(action, game_path, options):
+    # Runs in a worker, returns the result of the job with the timings of its phases
+    tycoon_patch.phase_log = []
+    with contextlib.redirect_stdout(io.StringIO()):
+        if action == "verify":
+            result = tycoon_patch.identify(game_path)
+            result["undo_journal"] = tycoon_patch.read_undo_journal(game_path) is not None
+        elif action == "restore":
+            if not tycoon_patch.restore_backup(game_path):
+                raise ValueError("No backup is found")
+            result = {"path": game_path, "status": "restored"}
+        else:
+            width, height = (int(number) for number in options["resolution"].split('x'))
+            # An exe patched before is repatched, only the sites that differ between the two patches are changed
+            patch_plan = tycoon_patch.plan(game_path, (width, height), options.get("laa"))
+            if patch_plan["removes_disk_check"] and not options.get("remove_disk_check"):
+                # Same as --fleet without --yes
+                tycoon_patch.phase_log = None
+                return {"path": game_path, "status": "skipped", "game": patch_plan["game"], "crc": patch_plan["crc"],
+                        "error": "Disk check has to be removed, send the job with remove_disk_check to do that"}
+            # installs.json is written by the event loop, workers would overwrite each other's entries
+            result = tycoon_patch.apply(patch_plan, options.get("in_place", False),
+                                        stream=options.get("stream", False), remember=False)
+    result["phases"] = tycoon_patch.phase_log
+    tycoon_patch.phase_log = None
+    return result
+
+def check_job(request):
+    # Returns what's wrong with the job request, or None
+    if not isinstance(request, dict):
+        return "Job has to be an object"
+    if request.get("action") not in ("patch", "verify", "restore"):
+        return "Action has to be patch, verify or restore"
+    if not isinstance(request.get("path"), str):
+        return "Path of the exe is missing"
+    if request["action"] == "patch":
+        resolution = request.get("resolution")
+        if not isinstance(resolution, str) or len(resolution.split('x')) != 2 or \
+                not all(number.isdigit() for number in resolution.split('x')):
+            return "Resolution has to be given as (width)x(height)"
+    return None
+
+async def run_queued_job(service, job, options):
+    # Jobs for the same exe are run one after another
+    lock = service["locks"].setdefault(job["path"], asyncio.Lock())
+    service["pending"][job["path"]] += 1
+    async with lock:
+        job["status"] = "running"
+        job["started"] = time.time()
+        loop = asyncio.get_running_loop()
+        try:
+            job["result"] = await loop.run_in_executor(service["executor"], run_job,
+                                                       job["action"], job["path"], options)
+            if job["result"].get("status") == "patched" and job["result"].get("crc") is not None:
+                # Which stored original belongs to the exe, for restoring it later
+                tycoon_patch.remember_installs({job["path"]: job["result"]["crc"]})
+            job["status"] = "done"
+        except Exception as error:
+            job["status"] = "failed"
+            job["error"] = f"{type(error).__name__}: {error}"
+        job["finished"] = time.time()
+        job["duration"] = round(job["finished"] - job["started"], 6)
+
+    service["finished"].append((job["finished"], job["duration"], job["status"]))
+    forget_old_finished(service, job["finished"])
+    service["pending"][job["path"]] -= 1
+    if not service["pending"][job["path"]]:
+        del service["pending"][job["path"]]
+        del service["locks"][job["path"]]
+    # Forgetting the oldest finished jobs
+    while len(service["jobs"]) > kept_jobs:
+        oldest_id = next(iter(service["jobs"]))
+        if service["jobs"][oldest_id]["status"] not in ("done", "failed"):
+            break
+        del service["jobs"][oldest_id]
+
+def submit_job(service, request):
+    service["last_id"] += 1
+    job = {
+        "id": service["last_id"],
+        "action": request["action"],
+        "path": os.path.abspath(request["path"]),
+        "status": "queued",
+        "submitted": time.time(),
+        "started": None,
+        "finished": None,
+        "duration": None,
+        "result": None,
+        "error": None
+    }
+    service["jobs"][job["id"]] = job
+    options = {"resolution": request.get("resolution"), "laa": request.get("laa"),
+               "in_place": bool(request.get("in_place")), "stream": bool(request.get("stream")),
+               "remove_disk_check": request.get("remove_disk_check") is True}
+    task = asyncio.get_running_loop().create_task(run_queued_job(service, job, options))
+    return job, task
+
+def forget_old_finished(service, now):
+    # Jobs of the last minute tell the current throughput, the older ones only count for the total
+    finished = service["finished"]
+    while finished and finished[0][0] < now - 60:
+        finished.popleft()
+        service["finished_total"] += 1
+
+def get_metrics(service):
+    now = time.time()
+    uptime = now - service["started"]
+    statuses = collections.Counter(job["status"] for job in service["jobs"].values())
+    forget_old_finished(service, now)
+    finished = service["finished"]
+    durations = [duration for _, duration, _ in finished]
+    return {
+        "uptime": round(uptime, 3),
+        "workers": service["workers"],
+        "jobs": {status: statuses.get(status, 0) for status in ("queued", "running", "done", "failed")},
+        "jobs_submitted": service["last_id"],
+        "jobs_finished": service["finished_total"] + len(finished),
+        "last_minute": {
+            "jobs": len(finished),
+            "failed": sum(1 for _, _, status in finished if status == "failed"),
+            "jobs_per_second": round(len(finished) / min(uptime, 60), 3) if uptime else 0,
+            "mean_duration": round(sum(durations) / len(durations), 6) if durations else None
+        }
+    }
+
+async def handle_request(service, method, path, body):
+    # Returns the status code and the JSON of the response
+    if method == "GET" and path == "/metrics":
+        return 200, get_metrics(service)
+    if method == "GET" and path.startswith("/jobs/"):
+        job_id = path[len("/jobs/"):]
+        if job_id.isdigit() and int(job_id) in service["jobs"]:
+            return 200, service["jobs"][int(job_id)]
+        return 404, {"error": "Job is not found"}
+    if method == "POST" and path == "/jobs":
+        try:
+            requests = json.loads(body or b"null")
+        except ValueError:
+            return 400, {"error": "Body has to be JSON"}
+        many = isinstance(requests, list)
+        if not many:
+            requests = [requests]
+        for request in requests:
+            error = check_job(request)
+            if error:
+                return 400, {"error": error}
+
+        submitted = [submit_job(service, request) for request in requests]
+        if any(request.get("wait") for request in requests):
+            await asyncio.gather(*(task for _, task in submitted))
+        jobs = [job for job, _ in submitted]
+        return 202 if any(job["status"] in ("queued", "running") for job in jobs) else 200, \
+            jobs if many else jobs[0]
+    return 404, {"error": "Not found"}
+
+async def serve_connection(service, reader, writer):
+    # Minimal HTTP/1.1: one request per connection, JSON in and out
+    status, response = 400, {"error": "Bad request"}
+    try:
+        request_line = (await reader.readline()).decode('latin-1').split()
+        headers = {}
+        while True:
+            line = (await reader.readline()).decode('latin-1').strip()
+            if not line:
+                break
+            name, _, value = line.partition(':')
+            headers[name.strip().lower()] = value.strip()
+        body = await reader.readexactly(int(headers.get("content-length", 0)))
+        content_type = headers.get("content-type", "").partition(';')[0].strip().lower()
+        authorization = headers.get("authorization", "").encode('latin-1')
+        if service["token"] and not secrets.compare_digest(authorization, f"Bearer {service['token']}".encode()):
+            status, response = 401, {"error": "Token is missing or wrong"}
+        elif len(request_line) >= 2 and request_line[0] == "POST" and content_type != "application/json":
+            status, response = 415, {"error": "Content-Type has to be application/json"}
+        elif len(request_line) >= 2:
+            status, response = await handle_request(service, request_line[0], request_line[1], body)
+    except (ValueError, asyncio.IncompleteReadError):
+        pass
+
+    reasons = {200: "OK", 202: "Accepted", 400: "Bad Request", 401: "Unauthorized", 404: "Not Found",
+               415: "Unsupported Media Type"}
+    data = json.dumps(response).encode()
+    writer.write(f"HTTP/1.1 {status} {reasons[status]}\r\nContent-Type: application/json\r\n"
+                 f"Content-Length: {len(data)}\r\nConnection: close\r\n\r\n".encode() + data)
+    try:
+        await writer.drain()
+    except ConnectionError:
+        pass
+    writer.close()
+
+def save_token(token):
+    # Only the user running the service can read it
+    token_path = os.path.join(tycoon_patch.get_cache_dir(), "service_token")
+    os.makedirs(os.path.dirname(token_path), exist_ok=True)
+    fd = os.open(token_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+    with os.fdopen(fd, 'w') as file:
+        file.write(token)
+    return token_path
+
+async def serve(port=8765, socket_path=None, workers=None, token=None):
+    if not socket_path and not token:
+        token = secrets.token_urlsafe(32)
+        print(f"Token is saved to {save_token(token)}")
+    service = {
+        "jobs": collections.OrderedDict(),
+        "locks": {},
+        "pending": collections.Counter(),
+        "last_id": 0,
+        "started": time.time(),
+        "finished": collections.deque(),
+        "finished_total": 0,
+        "workers": workers or os.cpu_count(),
+        "token": None if socket_path else token,
+        "executor": concurrent.futures.ProcessPoolExecutor(max_workers=workers, initializer=load_rule_engines)
+    }
+
+    def handle(reader, writer):
+        return serve_connection(service, reader, writer)
+
+    if socket_path:
+        server = await asyncio.start_unix_server(handle, socket_path)
+        print(f"Listening on {socket_path}")
+    else:
+        server = await asyncio.start_server(handle, "127.0.0.1", port)
+        print(f"Listening on http://127.0.0.1:{port}")
+    sys.stdout.flush()
+    try:
+        async with server:
+            await server.serve_forever()
+    finally:
+        service["executor"].shutdown(cancel_futures=True)
+
+def main(arguments):
+    port = 8765
+    socket_path = None
+    workers = None
+    token = None
+    for arg in arguments[1:]:
+        if arg.startswith("--port="):
+            port = int(arg.split('=', 1)[1])
+        elif arg.startswith("--socket="):
+            socket_path = arg.split('=', 1)[1]
+        elif arg.startswith("--workers="):
+            workers = int(arg.split('=', 1)[1])
+        elif arg.startswith("--token="):
+            token = arg.split('=', 1)[1]
+    try:
+        asyncio.run(serve(port, socket_path, workers, token))
+    except KeyboardInterrupt:
+        pass
+
+if __name__ == "__main__":
+    main(sys.argv)